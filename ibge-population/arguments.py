@@ -0,0 +1,35 @@
+from metrics import add_arguments
+from shards import add_shard_arguments
+
+# Options of fix_populations.py and wbedit.py, kept apart from them so that
+# main.py lists its commands without importing aiohttp (through http_client)
+
+API = "https://www.wikidata.org/w/api.php"
+PASSWORD_ENV = "WIKIBASE_BOT_PASSWORD"
+MAXLAG = 5
+DRY_RUN_PATH = "wbedit.dry-run.jsonl"  # the edits of --dry-run, which has its own journal
+
+
+def add_fix_arguments(parser):
+    parser.add_argument("--concurrency", type=int, default=4, help="max requests in flight")
+    parser.add_argument("--rate", type=float, default=5.0, help="max requests per second")
+    parser.add_argument("--refresh", action="store_true", help="ignore the cached P1585 mapping")
+    parser.add_argument("--dump", help="read items from a Wikidata JSON dump (.json, .json.gz or .json.bz2) instead of the API")
+    parser.add_argument("--jobs", type=int, default=None, help="processes analysing the dump (default: all cores)")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="dump lines per worker task")
+    parser.add_argument("--resume", action="store_true", help="skip items already in the journal of a previous run")
+    add_shard_arguments(parser, prefix="fix_populations")
+    add_arguments(parser, report="./fix_populations.report.json")
+
+
+def add_write_arguments(parser):
+    parser.add_argument("files", nargs="+", help=".qs files or shards (.qs.gz) to submit")
+    parser.add_argument("--api", default=API, help=f"Action API endpoint (default: {API})")
+    parser.add_argument("--username", help=f"bot password user name (User@bot), the password is read from ${PASSWORD_ENV}")
+    parser.add_argument("--edits-per-minute", type=float, default=30.0, help="max wbeditentity edits per minute")
+    parser.add_argument("--concurrency", type=int, default=4, help="max requests in flight")
+    parser.add_argument("--rate", type=float, default=5.0, help="max requests per second")
+    parser.add_argument("--maxlag", type=int, default=MAXLAG, help="maxlag of every request, in seconds")
+    parser.add_argument("--resume", action="store_true", help="skip items already in the journal of a previous run")
+    parser.add_argument("--dry-run", action="store_true", help=f"write the edits to {DRY_RUN_PATH} instead of submitting them")
+    add_arguments(parser, report="./wbedit.report.json")
@@ -0,0 +1,92 @@
+import argparse
+import json
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+from codes import CODE_DTYPE
+from codes import ibge_code
+from codes import parse_codes
+from wikidata import IbgeCodeToQid
+from benchmarks.run import RESULTS, git_commit, previous_results
+from benchmarks.synthetic import municipalities
+
+# Memory and throughput of the IBGE code handling from the parsed spreadsheet
+# columns to the QIDs: codes as strings ("UF" + zero padded "MUNIC") looked up
+# in a dict of str -> "Q..", as before codes.py, against int32 codes from
+# integer arithmetic joined on the sorted int arrays of IbgeCodeToQid.
+# Results go to benchmarks/results.jsonl (format "codes") like benchmarks.run.
+# Run from ibge-population: python -m benchmarks.codes [--scales 5570 1000000]
+
+
+def columns(rows):
+    # the text columns of a parsed estimate, and the P1585 mapping
+    places = municipalities(rows)
+    uf = pd.Series([str(uf) for uf, _, _, _ in places], dtype=object)
+    munic = pd.Series([str(munic) for _, munic, _, _ in places], dtype=object)
+    population = np.array([p for _, _, _, p in places], dtype=np.int64)
+    codes = ibge_code(np.array([uf for uf, _, _, _ in places]), np.array([m for _, m, _, _ in places]))
+    qids = np.arange(1000, 1000 + rows, dtype=np.int64)
+    return uf, munic, population, codes.astype(CODE_DTYPE), qids
+
+
+def strings(uf, munic, population, codes, qids):
+    mapping = {str(code): f"Q{qid}" for code, qid in zip(codes.tolist(), qids.tolist())}
+    code = uf + munic.str.rjust(5, fillchar="0")
+    pops = dict(zip(code.tolist(), population.tolist()))
+    return [(mapping[c], p) for c, p in pops.items()]
+
+
+def ints(uf, munic, population, codes, qids):
+    mapper = IbgeCodeToQid()
+    order = np.argsort(codes, kind="stable")
+    mapper.codes, mapper.qids = codes[order], qids[order]
+    code = ibge_code(parse_codes(uf), parse_codes(munic))
+    return mapper.join(pd.DataFrame({"code": code, "population": population}))
+
+
+def measure(fn, *args):
+    # timed without tracemalloc, which slows the object-heavy path down most
+    start = time.perf_counter()
+    result = fn(*args)
+    seconds = time.perf_counter() - start
+    del result
+    tracemalloc.start()
+    result = fn(*args)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, {"seconds": seconds, "peak_mib": peak / 2**20, "kept_mib": current / 2**20}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scales", type=int, nargs="+", default=[5_570, 100_000, 1_000_000])
+    args = parser.parse_args()
+
+    commit = git_commit()
+    previous = previous_results(commit)
+    now = datetime.now(timezone.utc).isoformat(timespec="seconds")
+    with open(RESULTS, "a") as f:
+        for rows in args.scales:
+            data = columns(rows)
+            for stage, fn in (("strings", strings), ("ints", ints)):
+                result, entry = measure(fn, *data)
+                assert len(result) == rows
+                del result
+                entry = {"commit": commit, "time": now, "rows": rows, "format": "codes", "stage": stage, **entry}
+                f.write(json.dumps(entry) + "\n")
+                line = (
+                    f"{rows:>8} {stage:<8} {entry['seconds']:9.3f}s"
+                    f" {entry['peak_mib']:9.1f}MiB peak {entry['kept_mib']:9.1f}MiB kept"
+                )
+                before = previous.get((rows, "codes", stage))
+                if before is not None and before["seconds"] > 0:
+                    line += f"  {entry['seconds'] / before['seconds']:5.2f}x vs {before['commit']}"
+                print(line, flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+import os
+import sys
+import tempfile
+
+from benchmarks.synthetic import method_snak, statement, time_snak
+from fix_populations import InitialCommands, rest_statement
+from fix_rules import EDIT_SUMMARY, analyse_items
+
+# Regression check of fix_rules.analyse_items(): one item per case of
+# DROP_RULES and YEAR_RULES, with the commands (or the failure) expected for
+# it, as the statement by statement analysis it replaced produced them. Run
+# after editing the rule tables, from ibge-population:
+#   python -m benchmarks.fix_rules_check
+
+ESTIMATE = method_snak("Q791801")
+CENSUS = method_snak("Q39825")
+SUMMARY = f"|/* {EDIT_SUMMARY} */"
+
+
+def qs(qid, amount, date, precision, method):
+    # a result.qs command
+    return (
+        f"+{qid}|P1082|{amount}|P585|+{date}T00:00:00Z/{precision}|P459|{method}"
+        f'|S854|"https://ibge.example/{qid}"|S813|+2025-08-29T00:00:00Z/11'
+    )
+
+
+# Q10 before Q1, so that an index mixing up their commands shows
+RESULT_QS = [
+    qs("Q10", 1000, "2010-07-01", 9, "Q39825"),
+    qs("Q10", 1010, "2025-07-01", 11, "Q791801"),
+    qs("Q1", 110, "2024-07-01", 11, "Q791801"),
+    qs("Q1", 100, "2025-07-01", 11, "Q791801"),
+    qs("Q3", 300, "2010-07-01", 9, "Q39825"),
+    qs("Q4", 400, "2010-07-01", 9, "Q39825"),
+    qs("Q4", 410, "2022-07-01", 9, "Q39825"),
+    qs("Q4", 420, "2025-07-01", 11, "Q791801"),
+    qs("Q5", 500, "2010-07-01", 9, "Q39825"),
+    qs("Q6", 600, "2010-07-01", 9, "Q39825"),
+    qs("Q7", 700, "2010-07-01", 9, "Q39825"),
+    qs("Q8", 800, "2000-07-01", 9, "Q39825"),
+    qs("Q8", 810, "2010-07-01", 9, "Q39825"),
+    qs("Q8", 820, "2019-07-01", 11, "Q791801"),
+    qs("Q9", 900, "2010-07-01", 9, "Q39825"),
+]
+
+# QID -> (P1082 statements as (amount, qualifiers), expected commands or failure reason)
+CASES = {
+    # same year, the new qualifier is more precise: the old one goes; then two
+    # years in another statement: removed and added again from result.qs
+    "Q1": (
+        [(100, [time_snak(2025, 9), time_snak(2025, 11), ESTIMATE]),
+         (110, [time_snak(2024, 11), time_snak(2025, 11), ESTIMATE])],
+        [
+            "REMOVE_QUAL|Q1|P1082|+100|P585|+2025-00-00T00:00:00Z/9",
+            "-Q1|P1082|+110",
+            qs("Q1", 110, "2024-07-01", 11, "Q791801"),
+            qs("Q1", 100, "2025-07-01", 11, "Q791801") + SUMMARY,
+        ],
+    ),
+    # same year, the old qualifier is more precise: the new one goes
+    "Q2": (
+        [(200, [time_snak(2025, 11), time_snak(2025, 9), ESTIMATE])],
+        ["REMOVE_QUAL|Q2|P1082|+200|P585|+2025-00-00T00:00:00Z/9" + SUMMARY],
+    ),
+    # census with 2000 then 2010: 2000 goes
+    "Q3": (
+        [(300, [time_snak(2000, 9), time_snak(2010, 9), CENSUS])],
+        ["REMOVE_QUAL|Q3|P1082|+300|P585|+2000-00-00T00:00:00Z/9" + SUMMARY],
+    ),
+    # 3 years, 2022 among them: no requalify, every year is added again
+    "Q4": (
+        [(400, [time_snak(2010, 9), time_snak(2022, 9), time_snak(2025, 11), CENSUS])],
+        [
+            "-Q4|P1082|+400",
+            qs("Q4", 400, "2010-07-01", 9, "Q39825"),
+            qs("Q4", 410, "2022-07-01", 9, "Q39825"),
+            qs("Q4", 420, "2025-07-01", 11, "Q791801") + SUMMARY,
+        ],
+    ),
+    # 2010 and 2022: the statement is requalified as 2010
+    "Q5": (
+        [(500, [time_snak(2010, 9), time_snak(2022, 9), CENSUS])],
+        [
+            "REMOVE_QUAL|Q5|P1082|500|P585|+2010-07-01T00:00:00Z/9",
+            "REMOVE_QUAL|Q5|P1082|500|P459|Q39825",
+            'REMOVE_REF|Q5|P1082|500|S854|"https://ibge.example/Q5"',
+            "REMOVE_REF|Q5|P1082|500|S813|+2025-08-29T00:00:00Z/11",
+            qs("Q5", 500, "2010-07-01", 9, "Q39825") + SUMMARY,
+        ],
+    ),
+    # 2000, 2010 and 2022: 2000 is forgotten, then requalified as 2010
+    "Q6": (
+        [(600, [time_snak(2000, 9), time_snak(2010, 9), time_snak(2022, 9), CENSUS])],
+        [
+            "REMOVE_QUAL|Q6|P1082|600|P585|+2010-07-01T00:00:00Z/9",
+            "REMOVE_QUAL|Q6|P1082|600|P459|Q39825",
+            'REMOVE_REF|Q6|P1082|600|S854|"https://ibge.example/Q6"',
+            "REMOVE_REF|Q6|P1082|600|S813|+2025-08-29T00:00:00Z/11",
+            qs("Q6", 600, "2010-07-01", 9, "Q39825") + SUMMARY,
+        ],
+    ),
+    # a year without a result.qs command: the item fails
+    "Q7": (
+        [(700, [time_snak(2010, 9), time_snak(2019, 11), CENSUS])],
+        "missing qs commands for years: ['+2019']",
+    ),
+    # 2000, 2010 and 2019: 2000 is forgotten although result.qs has it
+    "Q8": (
+        [(800, [time_snak(2000, 9), time_snak(2010, 9), time_snak(2019, 11), CENSUS])],
+        [
+            "-Q8|P1082|+800",
+            qs("Q8", 810, "2010-07-01", 9, "Q39825"),
+            qs("Q8", 820, "2019-07-01", 11, "Q791801") + SUMMARY,
+        ],
+    ),
+    # 2000 then 2010 but not only census: not dropped, 2000 is forgotten
+    "Q9": (
+        [(900, [time_snak(2000, 9), time_snak(2010, 9), ESTIMATE])],
+        ["-Q9|P1082|+900", qs("Q9", 900, "2010-07-01", 9, "Q39825") + SUMMARY],
+    ),
+    # Q10 must get its own commands, not those of Q1
+    "Q10": (
+        [(1000, [time_snak(2010, 9), time_snak(2025, 11), CENSUS])],
+        [
+            "-Q10|P1082|+1000",
+            qs("Q10", 1000, "2010-07-01", 9, "Q39825"),
+            qs("Q10", 1010, "2025-07-01", 11, "Q791801") + SUMMARY,
+        ],
+    ),
+    # a single P585: nothing to do
+    "Q11": (
+        [(1100, [time_snak(2025, 11), ESTIMATE])],
+        [],
+    ),
+}
+
+
+def main():
+    items = {
+        qid: [rest_statement(statement(qid, n, amount, qualifiers)) for n, (amount, qualifiers) in enumerate(statements)]
+        for qid, (statements, _) in CASES.items()
+    }
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "result.qs")
+        with open(path, "w") as f:
+            f.write("\n".join(RESULT_QS) + "\n")
+        results = analyse_items(items, InitialCommands(path).for_qid)
+    failed = 0
+    for qid, commands, error in results:
+        got = commands if error is None else error
+        expected = CASES[qid][1]
+        if got == expected:
+            print(f"{qid:<4} ok")
+            continue
+        failed += 1
+        print(f"{qid:<4} FAILED\n  expected: {expected}\n  got:      {got}")
+    if failed:
+        sys.exit(f"{failed} of {len(CASES)} items differ")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+import pandas as pd
+
+from estimates import Estimate
+from ods import read_ods
+from benchmarks.synthetic import HEADERS, RawCell, estimate_rows, write_ods
+
+# Compares ods.read_ods with pd.read_excel (odfpy) on synthetic estimate files.
+# Run from ibge-population: python -m benchmarks.ods_reader
+
+COLUMNS = ("COD. UF", "COD. MUNIC", "POPULAÇÃO ESTIMADA")
+
+
+def read_pandas(path, skiprows, skipfooter):
+    df = pd.read_excel(
+        path, dtype=str, skiprows=skiprows, skipfooter=skipfooter, sheet_name="Municípios"
+    )
+    df = df.rename(columns=Estimate.RENAME_COLUMNS)
+    return df[df.columns[df.columns.isin(COLUMNS)]]
+
+
+def read_native(path, skiprows, skipfooter):
+    return read_ods(path, "Municípios", skiprows, skipfooter, Estimate.RENAME_COLUMNS, COLUMNS)
+
+
+def string_cell(xml):
+    return RawCell(f'<table:table-cell office:value-type="string">{xml}</table:table-cell>')
+
+
+def float_cell(value):
+    # a value without the <text:p> spreadsheet programs usually write too
+    return RawCell(f'<table:table-cell office:value-type="float" office:value="{value}"/>')
+
+
+# cells the synthetic estimates do not have: spaces as nested text:s, comments
+# (not part of the value) and rows of values without any text
+QUIRK_ROWS = [
+    list(HEADERS[0]),
+    ["RO", "11", "00015", "A", string_cell('<text:p>1<text:span>2<text:s text:c="2"/>3</text:span><text:s/>4</text:p>')],
+    ["RO", "11", "00023", "B", string_cell("<office:annotation><text:p>(*)</text:p></office:annotation><text:p>1.234</text:p>")],
+    [float_cell(11), float_cell(11), float_cell(31), float_cell(0), float_cell(5678)],
+    [None, float_cell(11), float_cell(49), None, float_cell(910)],
+    ["RO", "11", "00056", "C", "7.654"],
+]
+
+
+def check_quirks(tmp, skiprows, skipfooter):
+    path = os.path.join(tmp, "quirks.ods")
+    write_ods(path, QUIRK_ROWS, skiprows=skiprows, skipfooter=skipfooter)
+    expected = read_pandas(path, skiprows, skipfooter)
+    got = read_native(path, skiprows, skipfooter)
+    assert len(expected) == len(QUIRK_ROWS) - 1, expected
+    assert expected.fillna("").astype(str).equals(got.fillna("").astype(str)), (expected, got)
+    print(f"{'quirks':>8}       same values as pandas over {len(expected)} rows")
+
+
+def measure(fn, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fn(*args)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, nargs="+", default=[1_000, 5_570, 20_000])
+    args = parser.parse_args()
+    skiprows, skipfooter = 2, 2
+    with tempfile.TemporaryDirectory() as tmp:
+        check_quirks(tmp, skiprows, skipfooter)
+        for n in args.rows:
+            path = os.path.join(tmp, f"{n}.ods")
+            write_ods(path, estimate_rows(n), skiprows=skiprows, skipfooter=skipfooter)
+            expected, t_pandas, m_pandas = measure(read_pandas, path, skiprows, skipfooter)
+            got, t_native, m_native = measure(read_native, path, skiprows, skipfooter)
+            assert expected.fillna("").astype(str).equals(got.fillna("").astype(str))
+            print(
+                f"{n:>8} rows  pandas {t_pandas:7.3f}s {m_pandas / 2**20:8.1f}MiB"
+                f"  native {t_native:7.3f}s {m_native / 2**20:8.1f}MiB"
+                f"  speedup {t_pandas / t_native:5.1f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import fix_populations
+from estimates import Estimate
+from estimates import download_all
+from existing import ExistingStatements
+from external_sort import ExternalSorter
+from http_client import HttpClient
+from panel import Panel
+from wikidata import EstimateToQs
+from wikidata import IbgeCodeToQid
+from wikidata import sorted_commands
+from benchmarks.synthetic import HEADERS, estimate_rows, write_ods, write_xls, write_xlsx
+
+# Times every stage of main.py and fix_populations.py (download, parse, panel,
+# map, emit, existing, sort, write, fix) on synthetic estimates, against local stub servers
+# (benchmarks/stubs.py), and appends the results to benchmarks/results.jsonl.
+# Each run is compared with the results of the last other commit.
+# Run from ibge-population: python -m benchmarks.run [--scales 1000 1000000]
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS = os.path.join(REPO_DIR, "benchmarks", "results.jsonl")
+WRITERS = {"ods": write_ods, "xlsx": write_xlsx, "xls": write_xls}
+YEAR = 2025
+SKIPROWS = 2  # one more title row than the default, as in older files
+
+
+class Stages:
+    def __init__(self):
+        self.results = []
+
+    def measure(self, stage, fn, *args):
+        tracemalloc.start()
+        start = time.perf_counter()
+        result = fn(*args)
+        seconds = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        self.results.append({"stage": stage, "seconds": seconds, "peak_mib": peak / 2**20})
+        return result
+
+
+def git_commit():
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True, check=True
+        )
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def start_stubs(rows, files):
+    stubs = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.stubs", "--rows", str(rows), "--year", str(YEAR), "--files", files],
+        cwd=REPO_DIR,
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    return stubs, stubs.stdout.readline().strip()
+
+
+def skip_existing(base, df):
+    return ExistingStatements(f"{base}/sparql").load().missing(df)
+
+
+def sort(df, memory_budget):
+    sorter = ExternalSorter(memory_budget=memory_budget)
+    sorter.add_run(sorted_commands(df))
+    return sorter
+
+
+def write(sorter, path):
+    with sorter, open(path, "w") as f:
+        for cmd in sorter:
+            f.write(cmd + "\n")
+
+
+def fix(base, qids):
+    fix_populations.INITIAL_COMMANDS = fix_populations.InitialCommands("result.qs")
+    fetcher = fix_populations.EntityBatchFetcher(f"{base}/w/api.php")
+
+    async def run():
+        async with HttpClient(concurrency=8, rate=1000.0) as client:
+            batches = await asyncio.gather(*(fetcher.fetch(client, b) for b in fetcher.batches(qids)))
+        return [result for batch in batches for result in fix_populations.analyse(batch)]
+
+    return asyncio.run(run())
+
+
+def bench(rows, extension, args):
+    stages = Stages()
+    with tempfile.TemporaryDirectory() as tmp:
+        files = os.path.join(tmp, "files")
+        os.makedirs(files)
+        name = f"estimativa_{rows}.{extension}"
+        WRITERS[extension](
+            os.path.join(files, name), estimate_rows(rows, header=HEADERS[args.header]), skiprows=SKIPROWS
+        )
+        stubs, base = start_stubs(rows, files)
+        cwd = os.getcwd()
+        os.chdir(tmp)
+        try:
+            estimate = Estimate(
+                date=f"{YEAR}-07-01", url=f"{base}/files/{name}", skiprows=SKIPROWS, extension=extension
+            )
+            mapper = IbgeCodeToQid(cache_path=os.path.join(tmp, "ibge_code_to_qid.npz"))
+            mapper.ENDPOINT = f"{base}/sparql"
+            stages.measure("download", download_all, [estimate], 1, 1000.0)
+            stages.measure("parse", estimate.populations)
+            panel = stages.measure("panel", Panel.build, [estimate], [])
+            stages.measure("map", mapper.load, True)
+            df = stages.measure("emit", EstimateToQs(mapper).to_qs_frame, estimate, panel)
+            stages.measure("existing", skip_existing, base, df)
+            sorter = stages.measure("sort", sort, df, args.memory_budget * 2**20)
+            stages.measure("write", write, sorter, "result.qs")
+            qids = mapper.all_qids()[: args.fix_items]
+            stages.measure("fix", fix, base, qids)
+        finally:
+            os.chdir(cwd)
+            stubs.terminate()
+            stubs.wait()
+    return stages.results
+
+
+def previous_results(commit):
+    # results of the most recent run on another commit, (rows, format, stage) -> result
+    if not os.path.exists(RESULTS):
+        return {}
+    with open(RESULTS, "r") as f:
+        entries = [json.loads(line) for line in f if line.strip()]
+    others = [e for e in entries if e["commit"] != commit]
+    if not others:
+        return {}
+    last = others[-1]["commit"]
+    return {(e["rows"], e["format"], e["stage"]): e for e in others if e["commit"] == last}
+
+
+def main():
+    logging.basicConfig(level="WARNING")
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scales", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--formats", nargs="+", choices=tuple(WRITERS), default=["ods", "xlsx"])
+    parser.add_argument("--header", type=int, default=2, help=f"index in synthetic.HEADERS (0-{len(HEADERS) - 1})")
+    parser.add_argument("--fix-items", type=int, default=2_000, help="items analysed in the fix stage")
+    parser.add_argument("--memory-budget", type=int, default=256, help="MiB, as in main.py")
+    parser.add_argument("--threshold", type=float, default=1.25, help="slowdown reported as a regression")
+    args = parser.parse_args()
+
+    commit = git_commit()
+    previous = previous_results(commit)
+    now = datetime.now(timezone.utc).isoformat(timespec="seconds")
+    regressions = 0
+    with open(RESULTS, "a") as f:
+        for rows in args.scales:
+            for extension in args.formats:
+                for result in bench(rows, extension, args):
+                    entry = {"commit": commit, "time": now, "rows": rows, "format": extension, **result}
+                    f.write(json.dumps(entry) + "\n")
+                    line = (
+                        f"{rows:>8} {extension:<4} {result['stage']:<8}"
+                        f" {result['seconds']:9.3f}s {result['peak_mib']:9.1f}MiB"
+                    )
+                    before = previous.get((rows, extension, result["stage"]))
+                    if before is not None and before["seconds"] > 0:
+                        ratio = result["seconds"] / before["seconds"]
+                        line += f"  {ratio:5.2f}x vs {before['commit']}"
+                        if ratio > args.threshold:
+                            line += "  REGRESSION"
+                            regressions += 1
+                    print(line, flush=True)
+    if regressions:
+        print(f"{regressions} stages slower than {args.threshold}x")
+
+
+if __name__ == "__main__":
+    main()
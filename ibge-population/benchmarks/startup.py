@@ -0,0 +1,85 @@
+import argparse
+import json
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+from benchmarks.run import REPO_DIR, RESULTS, git_commit, previous_results
+
+# Startup time of the lightweight commands, and which heavy modules they load.
+# Results go to benchmarks/results.jsonl (format "startup") like benchmarks.run.
+# Run from ibge-population: python -m benchmarks.startup
+
+COMMANDS = [
+    ["main.py", "--help"],
+    ["main.py", "fix", "--help"],
+    ["main.py", "write", "--help"],
+    ["fix_populations.py", "--help"],
+]
+HEAVY = ("pandas", "numpy", "pyarrow", "odf", "xlrd", "openpyxl", "aiohttp")
+
+# runs a script like `python script args`, then prints the heavy modules it loaded
+PROBE = """
+import runpy, sys
+sys.argv = sys.argv[1:]
+try:
+    runpy.run_path(sys.argv[0], run_name="__main__")
+except SystemExit:
+    pass
+sys.stdout.flush()
+print("\\0" + " ".join(m for m in {heavy!r} if m in sys.modules))
+"""
+
+
+def startup(command, repeat):
+    # best of `repeat` runs, in seconds
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, *command], cwd=REPO_DIR, capture_output=True, check=True)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def heavy_modules(command):
+    probe = PROBE.format(heavy=HEAVY)
+    out = subprocess.run(
+        [sys.executable, "-c", probe, *command], cwd=REPO_DIR, capture_output=True, text=True, check=True
+    ).stdout
+    return out.rsplit("\0", 1)[-1].split()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--threshold", type=float, default=1.25, help="slowdown reported as a regression")
+    args = parser.parse_args()
+
+    commit = git_commit()
+    previous = previous_results(commit)
+    now = datetime.now(timezone.utc).isoformat(timespec="seconds")
+    baseline = startup(["-c", "pass"], args.repeat)
+    print(f"{'python -c pass':<30} {baseline:7.3f}s")
+    with open(RESULTS, "a") as f:
+        for command in COMMANDS:
+            stage = " ".join(command)
+            seconds = startup(command, args.repeat)
+            heavy = heavy_modules(command)
+            entry = {
+                "commit": commit, "time": now, "rows": 0, "format": "startup",
+                "stage": stage, "seconds": seconds, "heavy_modules": heavy,
+            }
+            f.write(json.dumps(entry) + "\n")
+            line = f"{stage:<30} {seconds:7.3f}s  loads: {', '.join(heavy) or '-'}"
+            before = previous.get((0, "startup", stage))
+            if before is not None and before["seconds"] > 0:
+                ratio = seconds / before["seconds"]
+                line += f"  {ratio:5.2f}x vs {before['commit']}"
+                if ratio > args.threshold:
+                    line += "  REGRESSION"
+            print(line, flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+import argparse
+import itertools
+import json
+import os
+import re
+import sys
+import threading
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from benchmarks.synthetic import entity, municipalities
+
+# Local stand-ins for the services the scripts talk to:
+#   /sparql                                   P1585 query (JSON or TSV results),
+#                                             or existing P1082 statements (TSV, paginated)
+#   /w/api.php?action=wbgetentities&ids=...   Action API entities
+#   POST /w/api.php                           login and wbeditentity (recorded, and applied to what
+#                                             wbgetentities returns), with every --maxlag-every-th
+#                                             edit refused for maxlag and every --fail-every-th one
+#                                             saved but answered with a 503
+#   /edits                                    the recorded edits, QID -> wbeditentity data
+#   /w/rest.php/wikibase/v1/entities/items/Q  REST API entity
+#   /files/...                                static files (estimate downloads)
+# Run from ibge-population: python -m benchmarks.stubs --rows N --files DIR
+# It prints its base URL on the first line of stdout. Every other item already
+# has the population of the synthetic estimate of --year.
+
+ENTITY_PREFIX = "http://www.wikidata.org/entity/"
+XSD = "http://www.w3.org/2001/XMLSchema#"
+
+
+def qid_for(i):
+    return f"Q{1000 + i}"
+
+
+class Handler(SimpleHTTPRequestHandler):
+    rows = []  # (qid, code)
+    codes = {}  # qid -> code
+    amounts = {}  # qid -> population of the estimate statement, for some items
+    year = 2025
+    tokens = {"login": "login+\\", "csrf": "csrf+\\"}
+    maxlag_every = 0
+    fail_every = 0
+    edit_requests = itertools.count(1)
+    saved_edits = itertools.count(1)
+    edits = {}  # qid -> data of its wbeditentity edits
+    lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def send_body(self, body, content_type):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        if url.path == "/sparql":
+            return self.sparql(params.get("query", [""])[0])
+        if url.path == "/w/api.php" and params.get("action") == ["query"]:
+            return self.send_json({"query": {"tokens": {f"{kind}token": self.tokens[kind] for kind in params["type"]}}})
+        if url.path == "/w/api.php":
+            return self.wbgetentities(params["ids"][0].split("|"))
+        if url.path == "/edits":
+            with self.lock:
+                return self.send_json(self.edits)
+        if url.path.startswith("/w/rest.php/wikibase/v1/entities/items/"):
+            return self.rest_entity(url.path.rsplit("/", 1)[-1])
+        if url.path.startswith("/files/"):
+            self.path = self.path[len("/files"):]
+            return super().do_GET()
+        self.send_error(404)
+
+    def send_json(self, data, headers=()):
+        body = json.dumps(data).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        if urlparse(self.path).path != "/w/api.php":
+            return self.send_error(404)
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode()
+        params = {name: values[0] for name, values in parse_qs(body).items()}
+        if params["action"] == "login":
+            if params["lgtoken"] != self.tokens["login"]:
+                return self.send_json({"login": {"result": "Failed", "reason": "bad token"}})
+            return self.send_json({"login": {"result": "Success", "lgusername": params["lgname"]}})
+        if params["action"] != "wbeditentity":
+            return self.send_error(400)
+        if self.maxlag_every and next(self.edit_requests) % self.maxlag_every == 0:
+            error = {"code": "maxlag", "info": "Waiting for a database server: 6 seconds lagged", "lag": 6}
+            return self.send_json({"error": error}, headers=[("Retry-After", "0")])
+        if params.get("token") != self.tokens["csrf"]:
+            return self.send_json({"error": {"code": "badtoken", "info": "Invalid CSRF token."}})
+        with self.lock:
+            edits = self.edits.setdefault(params["id"], [])
+            if int(params["baserevid"]) != 1 + len(edits):
+                return self.send_json({"error": {"code": "editconflict", "info": "Edit conflict."}})
+            edits.append(json.loads(params["data"]))
+            revision = 1 + len(edits)
+        if self.fail_every and next(self.saved_edits) % self.fail_every == 0:
+            return self.send_error(503)
+        return self.send_json({"success": 1, "entity": {"id": params["id"], "lastrevid": revision}})
+
+    def sparql(self, query):
+        if "P1082" in query:
+            return self.existing(query)
+        accept = self.headers.get("Accept", "")
+        if "tab-separated-values" in accept:
+            lines = ["?item\t?code"]
+            lines += [f'<{ENTITY_PREFIX}{qid}>\t"{code}"' for qid, code in self.rows]
+            body = ("\n".join(lines) + "\n").encode()
+            return self.send_body(body, "text/tab-separated-values")
+        bindings = [
+            {"item": {"type": "uri", "value": ENTITY_PREFIX + qid},
+             "code": {"type": "literal", "value": str(code)}}
+            for qid, code in self.rows
+        ]
+        body = json.dumps({"head": {"vars": ["item", "code"]}, "results": {"bindings": bindings}})
+        return self.send_body(body.encode(), "application/sparql-results+json")
+
+    def existing(self, query):
+        # one row per statement x P585 x P459, like the SPARQL endpoint
+        limit = int(re.search(r"LIMIT (\d+)", query).group(1))
+        offset = int(re.search(r"OFFSET (\d+)", query).group(1))
+        lines = []
+        for qid, _ in self.rows:
+            for st in self.entity(qid)["claims"]["P1082"]:
+                amount = st["mainsnak"]["datavalue"]["value"]["amount"]
+                times = st["qualifiers"].get("P585", [])
+                methods = st["qualifiers"].get("P459", [])
+                for t in times:
+                    value = t["datavalue"]["value"]
+                    # year precision values come out as January 1st
+                    time = value["time"][1:].replace("-00-00", "-01-01")
+                    for m in methods:
+                        lines.append(
+                            f'<{ENTITY_PREFIX}{qid}>\t"{amount}"^^<{XSD}decimal>\t"{time}"^^<{XSD}dateTime>'
+                            f'\t"{value["precision"]}"^^<{XSD}integer>\t<{ENTITY_PREFIX}{m["datavalue"]["value"]["id"]}>'
+                        )
+        page = ["?item\t?amount\t?time\t?precision\t?method", *lines[offset:offset + limit]]
+        return self.send_body(("\n".join(page) + "\n").encode(), "text/tab-separated-values")
+
+    def entity(self, qid):
+        return entity(qid, self.codes[qid], self.year, amount=self.amounts.get(qid))
+
+    def edited(self, qid):
+        # the entity with its recorded edits applied, at revision 1 + edits
+        item = self.entity(qid)
+        with self.lock:
+            edits = list(self.edits.get(qid, []))
+        for n, data in enumerate(edits):
+            for i, claim in enumerate(data.get("claims", [])):
+                if "id" in claim:
+                    for statements in item["claims"].values():
+                        statements[:] = [st for st in statements if st.get("id") != claim["id"]]
+                if "remove" not in claim:
+                    claim = {**claim, "id": claim.get("id") or f"{qid}$edit-{n}-{i}"}
+                    item["claims"].setdefault(claim["mainsnak"]["property"], []).append(claim)
+        return {**item, "lastrevid": 1 + len(edits)}
+
+    def wbgetentities(self, ids):
+        entities = {}
+        for qid in ids:
+            if qid in self.codes:
+                entities[qid] = self.edited(qid)
+            else:
+                entities[qid] = {"id": qid, "missing": ""}
+        return self.send_body(json.dumps({"entities": entities}).encode(), "application/json")
+
+    def rest_entity(self, qid):
+        from fix_populations import rest_statement
+
+        if qid not in self.codes:
+            return self.send_error(404)
+        claims = self.entity(qid)["claims"]
+        statements = {pid: [rest_statement(st) for st in sts] for pid, sts in claims.items() if pid == "P1082"}
+        return self.send_body(json.dumps({"id": qid, "statements": statements}).encode(), "application/json")
+
+
+def serve(rows, year, files, port=0, maxlag_every=0, fail_every=0):
+    places = municipalities(rows)
+    Handler.rows = [(qid_for(i), uf * 100000 + munic) for i, (uf, munic, _, _) in enumerate(places)]
+    Handler.codes = dict(Handler.rows)
+    Handler.amounts = {qid_for(i): population for i, (_, _, _, population) in enumerate(places) if i % 2 == 0}
+    Handler.year = year
+    Handler.maxlag_every = maxlag_every
+    Handler.fail_every = fail_every
+    return ThreadingHTTPServer(("127.0.0.1", port), partial(Handler, directory=files))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=5570)
+    parser.add_argument("--year", type=int, default=2025)
+    parser.add_argument("--files", default=os.getcwd())
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--maxlag-every", type=int, default=0, help="refuse every n-th edit for maxlag (0: never)")
+    parser.add_argument("--fail-every", type=int, default=0, help="answer every n-th saved edit with a 503 (0: never)")
+    args = parser.parse_args()
+    server = serve(args.rows, args.year, args.files, args.port, args.maxlag_every, args.fail_every)
+    print(f"http://127.0.0.1:{server.server_address[1]}", flush=True)
+    sys.stdout.close()
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+import random
+import zipfile
+from xml.sax.saxutils import escape
+
+# Synthetic IBGE-like estimate spreadsheets and Wikidata entities, for benchmarks.
+
+UFS = [11, 12, 13, 14, 15, 16, 17, 21, 22, 23, 24, 25, 26, 27, 28, 29, 31, 32, 33,
+       35, 41, 42, 43, 50, 51, 52, 53]
+
+MANIFEST = """<?xml version="1.0" encoding="UTF-8"?>
+<manifest:manifest xmlns:manifest="urn:oasis:names:tc:opendocument:xmlns:manifest:1.0" manifest:version="1.2">
+ <manifest:file-entry manifest:full-path="/" manifest:media-type="application/vnd.oasis.opendocument.spreadsheet"/>
+ <manifest:file-entry manifest:full-path="content.xml" manifest:media-type="text/xml"/>
+</manifest:manifest>
+"""
+
+CONTENT_HEAD = """<?xml version="1.0" encoding="UTF-8"?>
+<office:document-content xmlns:office="urn:oasis:names:tc:opendocument:xmlns:office:1.0" xmlns:table="urn:oasis:names:tc:opendocument:xmlns:table:1.0" xmlns:text="urn:oasis:names:tc:opendocument:xmlns:text:1.0" office:version="1.2"><office:body><office:spreadsheet>"""
+
+CONTENT_TAIL = "</office:spreadsheet></office:body></office:document-content>"
+
+
+def municipalities(n, seed=0):
+    # (uf, munic, name, population) with unique codes, up to 2.7M of them
+    rng = random.Random(seed)
+    rows = []
+    for i in range(n):
+        uf = UFS[i % len(UFS)]
+        munic = 1 + i // len(UFS)
+        rows.append((uf, munic, f"Município {i}", rng.randint(800, 12_000_000)))
+    return rows
+
+
+def population_text(population, rng):
+    # the quirks found in IBGE files: thousand separators and footnote markers
+    text = f"{population:,}".replace(",", ".")
+    quirk = rng.random()
+    if quirk < 0.05:
+        return text + "(1)"
+    if quirk < 0.08:
+        return text + "(*)"
+    if quirk < 0.10:
+        return "(**) " + text
+    return text
+
+
+# header rows seen across the years, see Estimate.RENAME_COLUMNS
+HEADERS = [
+    ("UF", "COD. UF", "COD. MUNIC", "NOME DO MUNICÍPIO", "POPULAÇÃO ESTIMADA"),
+    ("UF", "COD. UF", "COD. MUNIC", "NOME DO MUNICÍPIO", " POPULAÇÃO ESTIMADA "),
+    ("UF", "COD", "COD", "NOME DO MUNICÍPIO", "ESTIMADA"),
+    ("UF", "U.F.", "MUNIC", "NOME DO MUNICÍPIO", "01.07.2008"),
+    ("UF", "COD. UF", "COD. MUNIC", "NOME DO MUNICÍPIO"),  # population is "Unnamed: 4"
+]
+
+
+def estimate_rows(n, seed=0, header=HEADERS[0]):
+    rng = random.Random(seed)
+    rows = [list(header)]
+    for uf, munic, name, population in municipalities(n, seed):
+        rows.append(["XX", uf, f"{munic:05d}", name, population_text(population, rng)])
+    return rows
+
+
+# a table-cell written as is, for layouts cell() does not produce
+class RawCell(str):
+    pass
+
+
+def cell(value):
+    if isinstance(value, RawCell):
+        return value
+    if value is None:
+        return "<table:table-cell/>"
+    if isinstance(value, int):
+        return (
+            f'<table:table-cell office:value-type="float" office:value="{value}">'
+            f"<text:p>{value}</text:p></table:table-cell>"
+        )
+    return f'<table:table-cell office:value-type="string"><text:p>{escape(value)}</text:p></table:table-cell>'
+
+
+def write_ods(path, rows, sheet_name="Municípios", skiprows=1, skipfooter=2):
+    # title rows before the header, footer notes after the data, and the huge
+    # repeated empty rows/columns that spreadsheet programs write
+    with zipfile.ZipFile(path, "w") as z:
+        z.writestr("mimetype", "application/vnd.oasis.opendocument.spreadsheet", compress_type=zipfile.ZIP_STORED)
+        z.writestr("META-INF/manifest.xml", MANIFEST)
+        with z.open("content.xml", "w") as f:
+            f.write(CONTENT_HEAD.encode())
+            f.write(f'<table:table table:name="Notas"><table:table-row>{cell("notas")}</table:table-row></table:table>'.encode())
+            f.write(f'<table:table table:name="{escape(sheet_name)}">'.encode())
+            for i in range(skiprows):
+                f.write(f"<table:table-row>{cell(f'ESTIMATIVAS DA POPULAÇÃO {i}')}</table:table-row>".encode())
+            for row in rows:
+                cells = "".join(cell(v) for v in row)
+                f.write(f'<table:table-row>{cells}<table:table-cell table:number-columns-repeated="1019"/></table:table-row>'.encode())
+            for i in range(skipfooter):
+                f.write(f"<table:table-row>{cell(f'Fonte: IBGE, nota {i}')}</table:table-row>".encode())
+            f.write('<table:table-row table:number-rows-repeated="1048000"><table:table-cell table:number-columns-repeated="1024"/></table:table-row>'.encode())
+            f.write(b"</table:table>")
+            f.write(CONTENT_TAIL.encode())
+
+
+def write_xlsx(path, rows, sheet_name="Municípios", skiprows=1, skipfooter=2):
+    import openpyxl
+
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet(sheet_name)
+    for i in range(skiprows):
+        ws.append([f"ESTIMATIVAS DA POPULAÇÃO {i}"])
+    for row in rows:
+        ws.append(row)
+    for i in range(skipfooter):
+        ws.append([f"Fonte: IBGE, nota {i}"])
+    wb.save(path)
+
+
+def write_xls(path, rows, sheet_name="Municípios", skiprows=1, skipfooter=2):
+    # xlwt is not a dependency of the scripts, only needed for this
+    import xlwt
+
+    wb = xlwt.Workbook()
+    ws = wb.add_sheet(sheet_name)
+    lines = [[f"ESTIMATIVAS DA POPULAÇÃO {i}"] for i in range(skiprows)]
+    lines += rows + [[f"Fonte: IBGE, nota {i}"] for i in range(skipfooter)]
+    for r, row in enumerate(lines):
+        for c, value in enumerate(row):
+            if value is not None:
+                ws.write(r, c, value)
+    wb.save(path)
+
+
+def time_snak(year, precision):
+    month_day = "-07-01" if precision >= 11 else "-00-00"
+    return {
+        "snaktype": "value",
+        "property": "P585",
+        "datavalue": {
+            "type": "time",
+            "value": {
+                "time": f"+{year}{month_day}T00:00:00Z",
+                "timezone": 0,
+                "before": 0,
+                "after": 0,
+                "precision": precision,
+                "calendarmodel": "http://www.wikidata.org/entity/Q1985727",
+            },
+        },
+    }
+
+
+def method_snak(qid):
+    return {
+        "snaktype": "value",
+        "property": "P459",
+        "datavalue": {
+            "type": "wikibase-entityid",
+            "value": {"entity-type": "item", "numeric-id": int(qid[1:]), "id": qid},
+        },
+    }
+
+
+def statement(qid, n, amount, qualifiers):
+    return {
+        "id": f"{qid}${n:08d}",
+        "rank": "normal",
+        "type": "statement",
+        "mainsnak": {
+            "snaktype": "value",
+            "property": "P1082",
+            "datavalue": {"type": "quantity", "value": {"amount": f"+{amount}", "unit": "1"}},
+        },
+        "qualifiers": {
+            pid: [q for q in qualifiers if q["property"] == pid]
+            for pid in dict.fromkeys(q["property"] for q in qualifiers)
+        },
+        "qualifiers-order": list(dict.fromkeys(q["property"] for q in qualifiers)),
+        "references": [],
+    }
+
+
+def entity(qid, code, year, seed=0, amount=None):
+    # an item (Action API/dump JSON) with P1585 and P1082 statements having
+    # the duplicate P585 cases fix_populations handles; `year` must be in
+    # the result.qs commands of the item, `amount` is the population of its
+    # `year` estimate statement (random if None)
+    rng = random.Random(f"{seed}-{qid}")
+    case = rng.random()
+    if amount is None:
+        amount = rng.randint(800, 10**6)
+    statements = [statement(qid, 0, amount, [time_snak(year, 11), method_snak("Q791801")])]
+    if case < 0.2:
+        quals = [time_snak(year, 9), time_snak(year, 11), method_snak("Q791801")]
+    elif case < 0.3:
+        quals = [time_snak(2000, 9), time_snak(2010, 9), method_snak("Q39825")]
+    elif case < 0.4:
+        quals = [time_snak(year, 11), time_snak(2022, 9), method_snak("Q791801")]
+    else:
+        quals = [time_snak(2010, 9), method_snak("Q39825")]
+    statements.append(statement(qid, 1, rng.randint(800, 10**6), quals))
+    return {
+        "type": "item",
+        "id": qid,
+        "claims": {
+            "P1585": [{
+                "mainsnak": {"snaktype": "value", "property": "P1585",
+                             "datavalue": {"type": "string", "value": str(code)}},
+                "type": "statement", "rank": "normal",
+            }],
+            "P1082": statements,
+        },
+    }
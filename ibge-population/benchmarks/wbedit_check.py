@@ -0,0 +1,100 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+from urllib.request import urlopen
+
+from arguments import PASSWORD_ENV
+from benchmarks.stubs import Handler, serve
+from benchmarks.synthetic import entity
+
+# Regression check of wbedit resubmits: `main.py write` against the stub API
+# answering every --fail-every-th saved edit with a 503. Each item removes its
+# second P1082 statement, and every other item adds the same amount again for
+# another year. Every item must get exactly one edit and end as the commands
+# say, whether or not its edit was answered with a 503.
+# Run from ibge-population: python -m benchmarks.wbedit_check
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ITEMS = 60
+FAIL_EVERY = 3
+YEAR = 2025
+
+
+def amount(statement):
+    return statement["mainsnak"]["datavalue"]["value"]["amount"].lstrip("+")
+
+
+def years(statement):
+    return [q["datavalue"]["value"]["time"][1:5] for q in statement.get("qualifiers", {}).get("P585", [])]
+
+
+def commands(qid, n):
+    # the removal of the second statement, and for even n the same amount for 2026
+    removed = amount(entity(qid, Handler.codes[qid], YEAR, amount=Handler.amounts.get(qid))["claims"]["P1082"][1])
+    lines = [f"-{qid}|P1082|{removed}"]
+    if n % 2 == 0:
+        lines.append(f'+{qid}|P1082|{removed}|P585|+2026-07-01T00:00:00Z/11|P459|Q791801|S854|"https://ibge.example"')
+    return removed, lines
+
+
+def check(qid, n, removed, edits, item):
+    # what is wrong with the item after the write, None if nothing
+    if len(edits) != 1:
+        return f"{len(edits)} edits"
+    statements = item["claims"]["P1082"]
+    if any(st.get("id") == f"{qid}$00000001" for st in statements):
+        return "the removed statement is still there"
+    expected = [["2026"]] if n % 2 == 0 else []
+    got = [years(st) for st in statements if amount(st) == removed]
+    if got != expected:
+        return f"statements of {removed}: {got}, expected {expected}"
+    return None
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        server = serve(ITEMS, YEAR, tmp, fail_every=FAIL_EVERY)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base = f"http://127.0.0.1:{server.server_address[1]}"
+        qids = list(Handler.codes)
+        removed = {}
+        with open(os.path.join(tmp, "result.qs"), "w") as f:
+            for n, qid in enumerate(qids):
+                removed[qid], lines = commands(qid, n)
+                f.write("\n".join(lines) + "\n")
+        try:
+            subprocess.run(
+                [
+                    sys.executable, os.path.join(REPO_DIR, "main.py"), "write", "result.qs",
+                    "--username", "User@bot", "--api", f"{base}/w/api.php", "--edits-per-minute", "60000",
+                ],
+                cwd=tmp,
+                env={**os.environ, PASSWORD_ENV: "secret"},
+                check=True,
+                capture_output=True,
+            )
+            failures_path = os.path.join(tmp, "wbedit.failures.jsonl")
+            failures = open(failures_path).read() if os.path.exists(failures_path) else ""
+            with urlopen(f"{base}/w/api.php?action=wbgetentities&ids={'|'.join(qids)}") as response:
+                items = json.load(response)["entities"]
+        finally:
+            server.shutdown()
+    failed = 0
+    for n, qid in enumerate(qids):
+        problem = check(qid, n, removed[qid], Handler.edits.get(qid, []), items[qid])
+        if problem is not None:
+            failed += 1
+            print(f"{qid:<6} FAILED: {problem}")
+    if failures:
+        failed += 1
+        print(f"failures:\n{failures}")
+    if failed:
+        sys.exit(f"{failed} problems in {len(qids)} items")
+    print(f"{len(qids)} items ok, one saved edit in {FAIL_EVERY} answered with a 503")
+
+
+if __name__ == "__main__":
+    main()
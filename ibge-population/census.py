@@ -1,7 +1,16 @@
+import os
+
+import numpy as np
 import pandas as pd
 
+from codes import parse_codes
+from frame_cache import cache_key
+from frame_cache import cached_frame
+
 
 class Census:
+    NA_VALUES = ["...", "-"]
+
     def __init__(self, url, path, skiprows, rename_columns, keep_columns, ignore_codes=[]):
         self.url = url
         self.path = path
@@ -12,30 +21,71 @@ class Census:
         self.sheet_name = "Tabela"
         self.skipfooter = 1
 
+    def parse_params(self):
+        return {
+            "kind": "census",
+            "skiprows": self.skiprows,
+            "skipfooter": self.skipfooter,
+            "sheet_name": self.sheet_name,
+            "rename_columns": self.rename_columns,
+            "keep_columns": self.keep_columns,
+            "na_values": self.NA_VALUES,
+        }
+
+    def source_id(self):
+        return f"census/{os.path.basename(self.path)}"
+
+    def input_hash(self):
+        # changes whenever populations_long() could change
+        return cache_key(self.path, {**self.parse_params(), "ignore_codes": self.ignore_codes})
+
     def df(self):
         if not hasattr(self, "_df"):
-            df = pd.read_excel(
-                self.path,
-                dtype=str,
-                skiprows=self.skiprows,
-                skipfooter=self.skipfooter,
-                sheet_name=self.sheet_name,
-                thousands=",",
-                decimal=".",
-                na_values=["...", "-"],
-            )
-            df = df.rename(columns=self.rename_columns)
-            for col in self.keep_columns:
-                assert col in df.columns, f"{col} not present in columns: {df.columns}"
-            df = df[df.columns[df.columns.isin(self.keep_columns)]]
-            self._df = df
+            self._df = cached_frame(self.path, self.parse_params(), self.parse)
         return self._df.copy()
 
-    def populations_per_year(self):
+    def parse(self):
+        df = pd.read_excel(
+            self.path,
+            dtype=str,
+            skiprows=self.skiprows,
+            skipfooter=self.skipfooter,
+            sheet_name=self.sheet_name,
+            thousands=",",
+            decimal=".",
+            na_values=self.NA_VALUES,
+        )
+        df = df.rename(columns=self.rename_columns)
+        for col in self.keep_columns:
+            assert col in df.columns, f"{col} not present in columns: {df.columns}"
+        df = df[df.columns[df.columns.isin(self.keep_columns)]]
+        return df
+
+    def codes_df(self):
+        # df() with int32 codes, without ignore_codes
         df = self.df()
+        df["code"] = parse_codes(df["code"])
         if self.ignore_codes:
-            df = df.loc[~df["code"].isin(self.ignore_codes)]
-        return df.set_index("code").to_dict(orient="index")
+            df = df.loc[~df["code"].isin(parse_codes(self.ignore_codes))]
+        return df
+
+    def populations_per_year(self):
+        return self.codes_df().set_index("code").to_dict(orient="index")
+
+    def populations_long(self):
+        # one row per (code, year) with a population (int32 code, int64
+        # population), in the same order as iterating populations_per_year():
+        # by code, then by year column
+        df = self.codes_df()
+        if df["code"].duplicated().any():
+            raise ValueError(f"repeated codes in {self.path}")
+        df = df.reset_index(drop=True)
+        long = df.melt(id_vars="code", var_name="year", value_name="population", ignore_index=False)
+        long = long.sort_index(kind="stable")
+        long = long.dropna(subset=["population"])
+        long = long[long["population"] != ""]
+        long["population"] = long["population"].to_numpy().astype(np.int64)
+        return long.reset_index(drop=True)
 
 
 # we only have one...
@@ -0,0 +1,25 @@
+import numpy as np
+
+# IBGE municipality codes are int32 from the parsers to the emitters: 7 digits,
+# the 2 digit UF code then the 5 digit municipality code (with its check
+# digit), e.g. UF 11 and municipality 00015 -> 1100015. QIDs are int64 numbers
+# (Q123 -> 123). Both only become strings in the output.
+
+CODE_DTYPE = np.int32
+QID_DTYPE = np.int64
+MUNIC_DIGITS = 5
+
+
+def ibge_code(uf, munic):
+    # ints or int arrays
+    return uf * 10**MUNIC_DIGITS + munic
+
+
+def parse_codes(values):
+    # int32 array of codes read as text ("1100015", " 00015") or numbers
+    return np.asarray(values).astype(np.int64).astype(CODE_DTYPE)
+
+
+def format_qids(qids):
+    # "Q123" strings of a QID array, for the output
+    return np.char.add("Q", np.asarray(qids, dtype=QID_DTYPE).astype(str))
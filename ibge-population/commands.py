@@ -0,0 +1,83 @@
+# QuickStatements commands as records, parsed once and written back with
+# serialize() only in the output:
+#   +Q1|P1082|123|P585|+2010-07-01T00:00:00Z/9|P459|Q39825|S854|"url"|S813|+2025-08-29T00:00:00Z/11
+#   -Q1|P1082|123
+#   REMOVE_QUAL|Q1|P1082|123|P585|+2010-07-01T00:00:00Z/9
+#   REMOVE_REF|Q1|P1082|123|S854|"url"
+# any of them possibly followed by |/* edit summary */.
+
+ADD = "+"
+REMOVE = "-"
+REMOVE_QUAL = "REMOVE_QUAL"
+REMOVE_REF = "REMOVE_REF"
+P_POINT_IN_TIME = "P585"
+P_METHOD = "P459"
+
+
+class Command:
+    __slots__ = ("action", "item", "property", "value", "qualifiers", "references", "summary")
+
+    def __init__(self, action, item, property, value, qualifiers=(), references=(), summary=None):
+        self.action = action  # ADD, REMOVE, REMOVE_QUAL or REMOVE_REF
+        self.item = item  # "Q1"
+        self.property = property
+        self.value = value  # as written in QuickStatements
+        self.qualifiers = qualifiers  # ((pid, value), ...)
+        self.references = references  # (("S854", value), ...), the parts of one reference
+        self.summary = summary
+
+    @classmethod
+    def parse(cls, line):
+        fields = line.rstrip("\n").split("|")
+        summary = None
+        if len(fields) > 1 and fields[-1].startswith("/*"):
+            summary = fields.pop()[2:-2].strip()
+        if fields[0] in (REMOVE_QUAL, REMOVE_REF):
+            action = fields.pop(0)
+            item = fields[0].lstrip("+-")
+        elif fields[0].startswith(REMOVE):
+            action, item = REMOVE, fields[0][1:]
+        else:
+            action, item = ADD, fields[0].lstrip("+")
+        qualifiers, references = [], []
+        for i in range(3, len(fields) - 1, 2):
+            pair = (fields[i], fields[i + 1])
+            (references if pair[0].startswith("S") else qualifiers).append(pair)
+        return cls(
+            action,
+            item,
+            fields[1] if len(fields) > 1 else None,
+            fields[2] if len(fields) > 2 else None,
+            tuple(qualifiers),
+            tuple(references),
+            summary,
+        )
+
+    def serialize(self):
+        if self.action in (ADD, REMOVE):
+            fields = [self.action + self.item]
+        else:
+            fields = [self.action, self.item]
+        fields += [f for f in (self.property, self.value) if f is not None]
+        for pid, value in self.qualifiers + self.references:
+            fields += [pid, value]
+        if self.summary:
+            fields.append(f"/* {self.summary} */")
+        return "|".join(fields)
+
+    __str__ = serialize
+
+    def __repr__(self):
+        return f"Command.parse({self.serialize()!r})"
+
+    def year(self):
+        # "+2010", the year of the first P585 qualifier (None without one)
+        for pid, value in self.qualifiers:
+            if pid == P_POINT_IN_TIME:
+                return value[:5]
+        return None
+
+    def with_summary(self, summary):
+        return Command(
+            self.action, self.item, self.property, self.value, self.qualifiers, self.references, summary
+        )
@@ -0,0 +1,126 @@
+import csv
+import hashlib
+import logging
+import os
+
+import numpy as np
+
+CROSSWALK_PATH = "./data/crosswalk.csv"
+
+
+# Municipality code changes as dated steps. Each step is a simultaneous
+# relabelling {old: new} (Series.replace semantics, so swaps and shifts like
+# 1100001 -> 1100015, 1100015 -> 1100155 mean what they say), and the codes of
+# a source from some date go through every later step in order: resolve()
+# composes them into one old -> final mapping, and apply() remaps a whole code
+# array with one lookup in a dense table over the remapped code range.
+class Crosswalk:
+    _shared = None
+
+    def __init__(self, steps=()):
+        # steps: (date or None, {old: new}), in the order they apply
+        self.steps = []
+        for date, mapping in steps:
+            olds = np.fromiter((int(old) for old in mapping), dtype=np.int64, count=len(mapping))
+            news = np.fromiter((int(new) for new in mapping.values()), dtype=np.int64, count=len(mapping))
+            order = np.argsort(olds)
+            self.steps.append((date, olds[order], news[order]))
+
+    @classmethod
+    def from_mapping(cls, mapping):
+        # one step, e.g. the fix_codes of one file
+        return cls([(None, mapping)] if mapping else [])
+
+    @classmethod
+    def load(cls, path=CROSSWALK_PATH):
+        # date,old,new rows, date being when the new code took effect; the
+        # rows of one date are one step
+        steps = {}
+        with open(path, "r", newline="") as f:
+            for row in csv.DictReader(f):
+                step = steps.setdefault(row["date"], {})
+                old, new = int(row["old"]), int(row["new"])
+                if step.get(old, new) != new:
+                    raise ValueError(f"{path}: {old} becomes both {step[old]} and {new} on {row['date']}")
+                step[old] = new
+        logging.info(f"loaded {sum(map(len, steps.values()))} code changes in {len(steps)} steps from {path}")
+        return cls(sorted(steps.items()))
+
+    @classmethod
+    def shared(cls):
+        # the table of CROSSWALK_PATH (empty without one), once per process
+        if cls._shared is None:
+            cls._shared = cls.load() if os.path.exists(CROSSWALK_PATH) else cls()
+        return cls._shared
+
+    def since(self, date):
+        # the steps that took effect after date (ISO strings compare as dates)
+        return Crosswalk._of([step for step in self.steps if step[0] is None or step[0] > date])
+
+    def __add__(self, other):
+        return Crosswalk._of(self.steps + other.steps)
+
+    @classmethod
+    def _of(cls, steps):
+        crosswalk = cls()
+        crosswalk.steps = steps
+        return crosswalk
+
+    def __bool__(self):
+        return bool(self.steps)
+
+    def digest(self):
+        h = hashlib.sha256()
+        for date, olds, news in self.steps:
+            h.update(str(date).encode())
+            h.update(olds.tobytes())
+            h.update(news.tobytes())
+        return h.hexdigest()[:16]
+
+    def resolve(self):
+        # sorted (old, final) arrays of the codes some step changes
+        if not hasattr(self, "_resolved"):
+            keys = np.empty(0, dtype=np.int64)
+            current = np.empty(0, dtype=np.int64)
+            for _, olds, news in self.steps:
+                # codes already changed follow the step from their current code...
+                taken = current
+                at = np.minimum(np.searchsorted(olds, current), max(len(olds) - 1, 0))
+                hit = olds[at] == current if len(olds) else np.zeros(len(current), dtype=bool)
+                current = np.where(hit, news[at], current)
+                # ...and the step's own codes join, unless they are such a code
+                # (b in a -> b, then b -> c) or were remapped already
+                fresh = ~np.isin(olds, keys) & ~np.isin(olds, taken)
+                keys = np.concatenate([keys, olds[fresh]])
+                current = np.concatenate([current, news[fresh]])
+            order = np.argsort(keys)
+            keys, current = keys[order], current[order]
+            finals, counts = np.unique(current, return_counts=True)
+            if (counts > 1).any():
+                merged = finals[counts > 1][:5].tolist()
+                raise ValueError(f"several codes end up as the same municipality: {merged}")
+            self._resolved = keys, current
+        return self._resolved
+
+    def table(self):
+        # final code of every code in [low, low + len(table)), memoised
+        if not hasattr(self, "_table"):
+            olds, finals = self.resolve()
+            low = int(olds[0]) if len(olds) else 0
+            table = np.arange(low, int(olds[-1]) + 1 if len(olds) else 0, dtype=np.int32)
+            table[olds - low] = finals
+            self._table = low, table
+        return self._table
+
+    def apply(self, codes):
+        # the final codes of a code array; two municipalities ending up with one
+        # code (a change the table misses) is an error
+        codes = np.asarray(codes, dtype=np.int64)
+        low, table = self.table()
+        inside = (codes >= low) & (codes < low + len(table))
+        remapped = codes.copy()
+        remapped[inside] = table[codes[inside] - low]
+        if len(np.unique(remapped)) < len(np.unique(codes)):
+            values, counts = np.unique(remapped, return_counts=True)
+            raise ValueError(f"codes collide after the crosswalk: {values[counts > 1][:5].tolist()}")
+        return remapped
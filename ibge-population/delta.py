@@ -0,0 +1,88 @@
+import os
+import json
+import shutil
+import logging
+
+import numpy as np
+import pandas as pd
+
+from panel import Panel
+
+# Populations emitted by previous runs, per source, for main.py --delta.
+# state.json has the input hash of each source; each source has its own
+# directory with the panel of that source (panel.py) and qids.npy, the QID
+# each code of the panel was emitted for.
+
+SNAPSHOT_DIR = "./data/cache/snapshot"
+COLUMNS = ["code", "date", "population", "qid"]
+
+
+class Snapshot:
+    def __init__(self, directory=SNAPSHOT_DIR):
+        self.directory = directory
+        self.state_path = os.path.join(directory, "state.json")
+        self.hashes = {}
+        self.pending = {}  # source_id -> (panel, qids) to save
+        if os.path.exists(self.state_path):
+            with open(self.state_path, "r") as f:
+                self.hashes = json.load(f)
+            logging.info(f"loaded snapshot of {len(self.hashes)} sources")
+
+    def source_dir(self, source_id):
+        return os.path.join(self.directory, source_id.replace("/", "-"))
+
+    def unchanged(self, source):
+        return self.hashes.get(source.source_id()) == source.input_hash()
+
+    def previous(self, source_id):
+        # COLUMNS rows emitted for the source by the last run, empty if none
+        directory = self.source_dir(source_id)
+        qids_path = os.path.join(directory, "qids.npy")
+        if source_id not in self.hashes or not os.path.exists(qids_path):
+            return pd.DataFrame({c: pd.Series(dtype=t) for c, t in zip(COLUMNS, ("int32", str, "int64", "int64"))})
+        panel = Panel.load(directory)
+        rows, cols = np.nonzero(panel.valid)
+        return pd.DataFrame({
+            "code": panel.codes[rows],
+            "date": panel.dates[cols].astype(str),
+            "population": panel.population[rows, cols],
+            "qid": np.load(qids_path)[rows],
+        })
+
+    def changed(self, source, df):
+        # rows of a to_qs_frame() frame not emitted before for this source
+        previous = self.previous(source.source_id())
+        rows = pd.DataFrame({
+            "code": df["code"].to_numpy(),
+            "date": df["date"].to_numpy(),
+            "population": df["population"].astype("int64").to_numpy(),
+            "qid": df["qid"].astype("int64").to_numpy(),
+        })
+        merged = rows.merge(previous, how="left", on=COLUMNS, indicator=True)
+        keep = (merged["_merge"] == "left_only").to_numpy()
+        logging.info(f"{source.source_id()}: {keep.sum()} of {len(df)} statements added or changed")
+        return df[keep]
+
+    def update(self, source, df, panel):
+        # df: the to_qs_frame() frame emitted for source from panel
+        selected = panel.select(source.source_id())
+        qids = np.zeros(len(selected.codes), dtype=np.int64)
+        qids[np.searchsorted(selected.codes, df["code"].to_numpy())] = df["qid"].to_numpy()
+        self.pending[source.source_id()] = (selected, qids)
+        self.hashes[source.source_id()] = source.input_hash()
+
+    def save(self):
+        for source_id, (panel, qids) in self.pending.items():
+            directory = self.source_dir(source_id)
+            tmp = directory + ".tmp"
+            shutil.rmtree(tmp, ignore_errors=True)
+            panel.save(tmp)
+            np.save(os.path.join(tmp, "qids.npy"), qids)
+            shutil.rmtree(directory, ignore_errors=True)
+            os.replace(tmp, directory)
+        self.pending = {}
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = self.state_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.hashes, f, indent=2, sort_keys=True)
+        os.replace(tmp, self.state_path)
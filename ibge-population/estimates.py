@@ -1,12 +1,39 @@
-import io
 import os
+import shutil
+import asyncio
 import zipfile
 import logging
-import requests
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
 import pandas as pd
 
+from codes import CODE_DTYPE
+from codes import ibge_code
+from codes import parse_codes
+from crosswalk import Crosswalk
+from frame_cache import cache_key
+from frame_cache import cached_frame
+from http_client import HttpClient
+from manifest import Manifest
+from metrics import METRICS
+from ods import read_ods
+
+DATA_DIR = "./data/estimate"
+
 
 class Estimate:
+    RENAME_COLUMNS = {
+        " POPULAÇÃO ESTIMADA ": "POPULAÇÃO ESTIMADA",
+        "ESTIMADA": "POPULAÇÃO ESTIMADA",
+        "01.07.2008": "POPULAÇÃO ESTIMADA",
+        "Unnamed: 4": "POPULAÇÃO ESTIMADA",
+        "U.F.": "COD. UF",
+        "COD": "COD. UF",
+        "COD.1": "COD. MUNIC",
+        "MUNIC": "COD. MUNIC",
+    }
+
     def __init__(
         self,
         date,
@@ -16,44 +43,111 @@ class Estimate:
         sheet_name="Municípios",
         fix_codes=None,
         extension="ods",
+        engine="native",
     ):
         self.date = date
         self.url = url
         self.skiprows = skiprows
         self.skipfooter = skipfooter
         self.sheet_name = sheet_name
+        # codes of this file only, relabelled before the crosswalk table
         self.fix_codes = fix_codes
         self.extension = extension
+        # "native" reads ODS files with ods.read_ods, "pandas" always uses pd.read_excel
+        self.engine = engine
 
     def path(self):
-        return f"./data/estimate/{self.date}.{self.extension}"
+        return f"{DATA_DIR}/{self.date}.{self.extension}"
 
-    def download(self):
-        if os.path.exists(self.path()):
-            logging.info(f"already downloaded: {self.path()}")
-            return
-        logging.info(f"downloading {self.url}")
-        response = requests.get(self.url)
+    def download_path(self):
+        # where the file from self.url goes, the zip itself is kept so that
+        # conditional requests work for it too
         if self.url.endswith("zip"):
-            self.unzip(response.content)
+            return f"{DATA_DIR}/{self.date}.zip"
+        return self.path()
+
+    async def download(self, client: HttpClient, manifest: Manifest):
+        target = self.download_path()
+        headers = {}
+        if manifest.verify(target):
+            headers = manifest.conditional_headers(target)
+        logging.info(f"downloading {self.url}")
+        try:
+            response_headers = await client.download(self.url, target, headers=headers)
+        except Exception:
+            if not headers:
+                raise
+            logging.exception(f"could not check {self.url}, using {target}")
+            response_headers = None
+        if response_headers is None:
+            METRICS.count("download.not_modified")
+            logging.info(f"already downloaded: {target}")
         else:
-            os.makedirs("./data/estimate", exist_ok=True)
-            with open(self.path(), "wb") as f:
-                f.write(response.content)
+            METRICS.count("download.files")
+            manifest.record(
+                target,
+                url=self.url,
+                etag=response_headers.get("ETag"),
+                last_modified=response_headers.get("Last-Modified"),
+            )
+        if target != self.path() and (response_headers is not None or not manifest.verify(self.path())):
+            self.unzip(target)
+            manifest.record(self.path(), source=os.path.basename(target))
 
-    def unzip(self, content):
-        zip_file = io.BytesIO(content)
-        with zipfile.ZipFile(zip_file, mode="r") as zip:
+    def unzip(self, zip_path):
+        with zipfile.ZipFile(zip_path, mode="r") as zip:
             for name in zip.namelist():
                 if name.endswith(self.extension):
                     logging.info(f"extracting: {name}")
+                    tmp = self.path() + ".part"
                     with zip.open(name, mode="r") as f_read:
-                        with open(self.path(), "wb") as f_write:
-                            f_write.write(f_read.read())
-                            break
+                        with open(tmp, "wb") as f_write:
+                            shutil.copyfileobj(f_read, f_write, 1 << 20)
+                    os.replace(tmp, self.path())
+                    return
+        raise ValueError(f"no .{self.extension} file in {zip_path}")
+
+    def parse_params(self):
+        return {
+            "kind": "estimate",
+            "skiprows": self.skiprows,
+            "skipfooter": self.skipfooter,
+            "sheet_name": self.sheet_name,
+            "rename_columns": self.RENAME_COLUMNS,
+            "engine": self.engine,
+        }
+
+    def source_id(self):
+        return f"estimate/{self.date}"
+
+    def input_hash(self):
+        # changes whenever populations() could change
+        params = {**self.parse_params(), "fix_codes": self.fix_codes}
+        if Crosswalk.shared().since(self.date):
+            params["crosswalk"] = Crosswalk.shared().since(self.date).digest()
+        return cache_key(self.path(), params)
+
+    def crosswalk(self):
+        # fix_codes, then the code changes (data/crosswalk.csv) since this estimate
+        return Crosswalk.from_mapping(self.fix_codes) + Crosswalk.shared().since(self.date)
 
     def df(self):
         if not hasattr(self, "_df"):
+            self._df = cached_frame(self.path(), self.parse_params(), self.parse)
+        return self._df.copy()
+
+    def parse(self):
+        columns = ("COD. UF", "COD. MUNIC", "POPULAÇÃO ESTIMADA")
+        if self.engine == "native" and self.extension == "ods":
+            df = read_ods(
+                self.path(),
+                sheet_name=self.sheet_name,
+                skiprows=self.skiprows,
+                skipfooter=self.skipfooter,
+                rename_columns=self.RENAME_COLUMNS,
+                columns=columns,
+            )
+        else:
             df = pd.read_excel(
                 self.path(),
                 dtype=str,
@@ -63,56 +157,75 @@ class Estimate:
                 thousands=",",
                 decimal=".",
             )
-            df = df.rename(
-                columns={
-                    " POPULAÇÃO ESTIMADA ": "POPULAÇÃO ESTIMADA",
-                    "ESTIMADA": "POPULAÇÃO ESTIMADA",
-                    "01.07.2008": "POPULAÇÃO ESTIMADA",
-                    "Unnamed: 4": "POPULAÇÃO ESTIMADA",
-                    "U.F.": "COD. UF",
-                    "COD": "COD. UF",
-                    "COD.1": "COD. MUNIC",
-                    "MUNIC": "COD. MUNIC",
-                }
-            )
-            columns = ("COD. UF", "COD. MUNIC", "POPULAÇÃO ESTIMADA")
+            df = df.rename(columns=self.RENAME_COLUMNS)
             for col in columns:
                 assert col in df.columns, f"{col} not present in columns: {df.columns}"
             df = df[df.columns[df.columns.isin(columns)]]
-            df = df.dropna(subset=["POPULAÇÃO ESTIMADA"])
-            df["POPULAÇÃO ESTIMADA"] = (
-                df["POPULAÇÃO ESTIMADA"]
-                .str.replace(r"\(\d+\)", "", regex=True)  # used for footnotes
-                .str.replace(r"\(?\*\)?\S*$", "", regex=True)  # used for footnotes
-                .str.replace(r"^\S*\(?\*\)?\S*", "", regex=True)  # used for footnotes
-                .str.replace(",", "")  # remove all decimal/thousand notation
-                .str.replace(".", "")
-                .astype(int)
-            )
-            self._df = df
-        return self._df.copy()
+        df = df.dropna(subset=["POPULAÇÃO ESTIMADA"])
+        df["POPULAÇÃO ESTIMADA"] = (
+            df["POPULAÇÃO ESTIMADA"]
+            .str.replace(r"\(\d+\)", "", regex=True)  # used for footnotes
+            .str.replace(r"\(?\*\)?\S*$", "", regex=True)  # used for footnotes
+            .str.replace(r"^\S*\(?\*\)?\S*", "", regex=True)  # used for footnotes
+            .str.replace(",", "")  # remove all decimal/thousand notation
+            .str.replace(".", "")
+            .astype(int)
+        )
+        return df
 
     def populations(self):
+        # (codes, populations): int32 codes and int64 populations, in file order
         if not hasattr(self, "_pops"):
             df = self.df()
             df = df.dropna(subset=["COD. MUNIC"])
-            df["COD. MUNIC"] = df["COD. MUNIC"].str.rjust(5, fillchar="0")
-            df["code"] = df["COD. UF"] + df["COD. MUNIC"]
-            if self.fix_codes:
-                df["code"] = df["code"].replace(self.fix_codes)
-            pops = df.set_index("code")["POPULAÇÃO ESTIMADA"].to_dict()
-            assert len(pops.keys()) == len(df), "some municipality went missing?"
-            self._pops = pops
+            codes = ibge_code(parse_codes(df["COD. UF"]), parse_codes(df["COD. MUNIC"]))
+            crosswalk = self.crosswalk()
+            if crosswalk:
+                codes = crosswalk.apply(codes).astype(CODE_DTYPE)
+            assert len(np.unique(codes)) == len(codes), "some municipality went missing?"
+            self._pops = codes, df["POPULAÇÃO ESTIMADA"].to_numpy(dtype=np.int64)
             logging.info(
                 f"loaded {self.total_municipalities()} municipalities from {self.date}, total population = {self.total_population()}"
             )
         return self._pops
 
     def total_municipalities(self):
-        return len(self.populations().keys())
+        return len(self.populations()[0])
 
     def total_population(self):
-        return sum(self.populations().values())
+        return int(self.populations()[1].sum())
+
+
+def download_all(estimates, concurrency=4, rate=2.0):
+    os.makedirs(DATA_DIR, exist_ok=True)
+    manifest = Manifest(DATA_DIR)
+
+    async def download():
+        async with HttpClient(concurrency=concurrency, rate=rate) as client:
+            await asyncio.gather(*(e.download(client, manifest) for e in estimates))
+
+    with METRICS.timer("download"):
+        asyncio.run(download())
+
+
+def population_arrays(estimate):
+    # worker side of load_populations: the arrays are much cheaper to send
+    # back than the DataFrame
+    return estimate.populations()
+
+
+def load_populations(estimates, jobs=None):
+    # parses all estimates, in parallel unless jobs == 1
+    with METRICS.timer("parse"):
+        if jobs == 1:
+            for estimate in estimates:
+                METRICS.count("estimate.rows", estimate.total_municipalities())
+            return
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            results = executor.map(population_arrays, estimates)
+            for estimate, pops in zip(estimates, results):
+                estimate._pops = pops
+                METRICS.count("estimate.rows", estimate.total_municipalities())
 
 
 ESTIMATE_YEARS = [
@@ -193,7 +306,8 @@ ESTIMATE_YEARS = [
         sheet_name="POP08DOU",
         extension="xls",
     ),
-    # After 2006, municipality codes change! :(
+    # Before 2007, municipality codes changed: these need the code changes
+    # since then in data/crosswalk.csv (date,old,new), see crosswalk.py
     # Estimate(
     #     date="2006-07-01",
     #     url="https://ftp.ibge.gov.br/Estimativas_de_Populacao/Estimativas_2006/UF_Municipio.zip",
@@ -206,7 +320,7 @@ ESTIMATE_YEARS = [
     #     url="https://ftp.ibge.gov.br/Estimativas_de_Populacao/Estimativas_1999/estimativa_populacao_1999_ods.zip",
     #     skiprows=2,
     #     sheet_name="Tab_Muniipios",
-    #     fix_codes={
+    #     fix_codes={  # or dated rows in data/crosswalk.csv
     #         "1100001": "1100015", # Alta Floresta D'Oeste
     #         "1100015": "1100155", # Ouro Preto do Oeste
     #         "1100155": "1101559", # Teixeirópolis
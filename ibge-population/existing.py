@@ -0,0 +1,145 @@
+import asyncio
+import logging
+
+import numpy as np
+import pandas as pd
+
+from http_client import HttpClient
+from metrics import METRICS
+
+
+# P1082 statements already on the items with a P1585, for main.py
+# --skip-existing: one row per (qid, amount, P585 value, P459 method) read
+# from a paginated SPARQL query, so that commands for populations Wikidata
+# already has can be dropped with one join.
+class ExistingStatements:
+    ENDPOINT = "https://query.wikidata.org/sparql"
+    QUERY = """
+    SELECT ?item ?amount ?time ?precision ?method WHERE {{
+        ?item wdt:P1585 [];
+              p:P1082 ?statement.
+        ?statement psv:P1082/wikibase:quantityAmount ?amount.
+        OPTIONAL {{
+            ?statement pqv:P585 ?value.
+            ?value wikibase:timeValue ?time;
+                   wikibase:timePrecision ?precision.
+        }}
+        OPTIONAL {{ ?statement pq:P459 ?method. }}
+    }}
+    ORDER BY ?statement ?time ?method
+    LIMIT {limit} OFFSET {offset}
+    """
+    HEADERS = {
+        "Accept": "text/tab-separated-values",
+    }
+    PAGE_SIZE = 200_000
+
+    def __init__(self, endpoint=ENDPOINT, page_size=PAGE_SIZE):
+        self.endpoint = endpoint
+        self.page_size = page_size
+
+    def load(self):
+        rows = TsvStatements()
+        with METRICS.timer("existing"):
+            asyncio.run(self.fetch(rows))
+        self.keys = rows.frame().drop_duplicates()
+        METRICS.count("existing.rows", len(self.keys))
+        logging.info(f"loaded {len(self.keys)} existing P1082 statements")
+        return self
+
+    async def fetch(self, rows):
+        async with HttpClient() as client:
+            offset = 0
+            while True:
+                query = self.QUERY.format(limit=self.page_size, offset=offset)
+                before = rows.count
+                rows.start_page()
+                async for line in client.iter_lines(self.endpoint, params={"query": query}, headers=self.HEADERS):
+                    rows.add(line)
+                if rows.count - before < self.page_size:
+                    return
+                offset += self.page_size
+
+    def missing(self, df):
+        # rows of a to_qs_frame() frame whose statement is not on Wikidata yet
+        precision = df["time"].str.rsplit("/", n=1).str[-1].astype(int)
+        keys = pd.DataFrame({
+            "qid": df["qid"].astype("int64").to_numpy(),
+            "amount": pd.to_numeric(df["population"]).astype("int64").to_numpy(),
+            "time": time_key(df["time"].str[1:], precision).to_numpy(),
+            "method": df["method"].astype(str).to_numpy(),
+        })
+        merged = keys.merge(self.keys, how="left", on=list(keys.columns), indicator=True)
+        keep = (merged["_merge"] == "left_only").to_numpy()
+        METRICS.count("existing.skipped", int((~keep).sum()))
+        logging.info(f"{(~keep).sum()} of {len(df)} statements already on Wikidata")
+        return df[keep]
+
+
+# the part of a time value its precision says something about:
+# "2010-07-01T00:00:00Z" -> "2010" (9, year), "2010-07" (10), "2010-07-01" (11)
+def time_key(times, precisions):
+    precisions = np.asarray(precisions)
+    return pd.Series(
+        np.select(
+            [precisions <= 9, precisions == 10],
+            [times.str[:4], times.str[:7]],
+            times.str[:10],
+        ),
+        index=times.index,
+    )
+
+
+# rows of the ?item ?amount ?time ?precision ?method TSV result, added line by line
+class TsvStatements:
+    HEADER = b"?item\t?amount\t?time\t?precision\t?method"
+    ITEM_PREFIX = b"<http://www.wikidata.org/entity/Q"
+    ENTITY_PREFIX = b"<http://www.wikidata.org/entity/"
+
+    def __init__(self):
+        self.qids = []
+        self.amounts = []
+        self.times = []
+        self.precisions = []
+        self.methods = []
+        self.count = 0
+        self.header = False
+
+    def start_page(self):
+        self.header = False
+
+    def add(self, line):
+        line = line.rstrip(b"\r\n")
+        if not self.header:
+            if line != self.HEADER:
+                raise ValueError(f"not a SPARQL TSV result of {self.HEADER!r}: {line[:200]!r}")
+            self.header = True
+            return
+        if not line:
+            return
+        item, amount, time, precision, method = line.split(b"\t")
+        self.count += 1
+        amount = literal(amount)
+        if not item.startswith(self.ITEM_PREFIX) or not amount.lstrip(b"+-").isdigit() or not time:
+            return  # decimals or no P585: no command would be the same
+        self.qids.append(int(item[len(self.ITEM_PREFIX):-1]))
+        self.amounts.append(int(amount))
+        self.times.append(literal(time).lstrip(b"+").decode())
+        self.precisions.append(int(literal(precision)))
+        self.methods.append(method[len(self.ENTITY_PREFIX):-1].decode() if method else "")
+
+    def frame(self):
+        times = pd.Series(self.times, dtype=object)
+        return pd.DataFrame({
+            "qid": np.array(self.qids, dtype=np.int64),
+            "amount": np.array(self.amounts, dtype=np.int64),
+            "time": time_key(times, np.array(self.precisions, dtype=np.int64)).to_numpy(),
+            "method": self.methods,
+        })
+
+
+def literal(value):
+    # lexical form of a TSV term: "2010-01-01T00:00:00Z"^^<...#dateTime> or 9
+    if value.startswith(b'"'):
+        return value[1:value.rindex(b'"')]
+    return value
@@ -0,0 +1,83 @@
+import os
+import sys
+import heapq
+import logging
+import tempfile
+
+
+# a buffered pair holds getsizeof() of both strs (non-ASCII text takes 2 or 4
+# bytes per character), plus the tuple and its slot in the run list
+PAIR_OVERHEAD = sys.getsizeof((None, None)) + 8
+
+
+# Merges sorted runs of (key, line) pairs. Runs are kept in memory while the
+# memory they hold (the str and tuple objects, in bytes) stays under
+# memory_budget, the others are spilled to temporary files. Iterating yields
+# the lines in key order, equal keys keep the order in which they were added,
+# like sorted() would.
+class ExternalSorter:
+    def __init__(self, memory_budget=256 * 2**20, tmp_dir=None):
+        self.memory_budget = memory_budget
+        self.tmp_dir = tmp_dir
+        self.runs = []  # lists of (key, line) or paths of spilled runs
+        self.in_memory = 0
+
+    def add_run(self, pairs):
+        # pairs must already be sorted by key; a run that does not fit in
+        # what is left of the budget is written to disk as it is read
+        pairs = iter(pairs)
+        run = []
+        size = 0
+        left = self.memory_budget - self.in_memory
+        getsizeof = sys.getsizeof
+        for key, line in pairs:
+            run.append((key, line))
+            size += getsizeof(key) + getsizeof(line) + PAIR_OVERHEAD
+            if size > left:
+                self.runs.append(self.spill(run, pairs))
+                return
+        self.runs.append(run)
+        self.in_memory += size
+
+    def spill(self, head, rest):
+        fd, path = tempfile.mkstemp(prefix="qs-run-", suffix=".tsv", dir=self.tmp_dir)
+        count = 0
+        with os.fdopen(fd, "w") as f:
+            for pairs in (head, rest):
+                for key, line in pairs:
+                    f.write(f"{key}\t{line}\n")
+                    count += 1
+        logging.info(f"spilled {count} lines to {path}")
+        return path
+
+    def __iter__(self):
+        iterators = [
+            iter(run) if isinstance(run, list) else read_run(run) for run in self.runs
+        ]
+        # heapq.merge breaks ties by iterator position, so order is stable
+        for _, line in heapq.merge(*iterators, key=pair_key):
+            yield line
+
+    def close(self):
+        for run in self.runs:
+            if isinstance(run, str) and os.path.exists(run):
+                os.remove(run)
+        self.runs = []
+        self.in_memory = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def pair_key(pair):
+    return pair[0]
+
+
+def read_run(path):
+    with open(path, "r") as f:
+        for row in f:
+            key, line = row.rstrip("\n").split("\t", 1)
+            yield key, line
@@ -1,208 +1,326 @@
-import requests
+import argparse
+import asyncio
+import bz2
+import contextlib
+import gzip
+import json
 import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import TYPE_CHECKING
 from typing import Optional
-from concurrent.futures import ThreadPoolExecutor
+
+from arguments import add_fix_arguments
+from commands import Command
+from metrics import METRICS
+from shards import ShardWriter
+
+if TYPE_CHECKING:
+    from http_client import HttpClient
 
 HEADERS = {
     "Accept": "application/json",
-    "User-Agent": "arcstur/wikidata-scripts (https://github.com/arcstur/wikidata-scripts)",
 }
 
-with open("result.qs", "r") as f:
-    ALL_INITIAL_COMMANDS = f.read().splitlines()
+
+# result.qs commands as QID -> year (e.g. "+2010") -> first Command for that
+# year, read once on first use and shared by all threads
+class InitialCommands:
+    def __init__(self, path="result.qs"):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def index(self):
+        if not hasattr(self, "_index"):
+            with self._lock:
+                if not hasattr(self, "_index"):
+                    self._index = self.load()
+        return self._index
+
+    def load(self):
+        index = {}
+        with open(self.path, "r") as f:
+            for line in f:
+                cmd = line.rstrip("\n")
+                if not cmd:
+                    continue
+                command = Command.parse(cmd)
+                index.setdefault(command.item, {}).setdefault(command.year(), command)
+        logging.info(f"indexed initial commands for {len(index)} items from {self.path}")
+        return index
+
+    def for_qid(self, qid):
+        return self.index().get(qid, {})
+
+
+INITIAL_COMMANDS = InitialCommands()
 
 
 class AllCitiesQid:
-    ENDPOINT = "https://query.wikidata.org/sparql"
-    QUERY = """
-    SELECT ?item ?code WHERE {
-        ?item wdt:P1585 ?code.
-    }
-    """
+    def __init__(self, refresh=False):
+        self.refresh = refresh
 
     def qids(self):
-        params = {"query": self.QUERY}
-        response = requests.get(self.ENDPOINT, params=params, headers=HEADERS)
-        response.raise_for_status()
-        data = response.json()
-        qids = []
-        for row in data["results"]["bindings"]:
-            qid = row["item"]["value"].split("/")[-1]
-            qids.append(qid)
-        return qids
-
-
-class JsonQid:
+        # same P1585 query (and cache) as main.py
+        from wikidata import IbgeCodeToQid
+
+        return IbgeCodeToQid.shared(refresh=self.refresh).all_qids()
+
+
+# Wikibase REST API shape of a statement from its Action API (wbgetentities) shape,
+# which is what the analysis in fix_rules reads
+def rest_statement(st):
+    qualifiers = []
+    for pid in st.get("qualifiers-order", list(st.get("qualifiers", {}).keys())):
+        for snak in st["qualifiers"][pid]:
+            qualifiers.append({"property": {"id": pid}, "value": rest_value(snak)})
+    references = []
+    for ref in st.get("references", []):
+        parts = []
+        for pid in ref.get("snaks-order", list(ref["snaks"].keys())):
+            for snak in ref["snaks"][pid]:
+                parts.append({"property": {"id": pid}, "value": rest_value(snak)})
+        references.append({"hash": ref.get("hash"), "parts": parts})
+    return {
+        "id": st["id"],
+        "rank": st["rank"],
+        "property": {"id": st["mainsnak"]["property"]},
+        "value": rest_value(st["mainsnak"]),
+        "qualifiers": qualifiers,
+        "references": references,
+    }
+
+
+def rest_value(snak):
+    if snak["snaktype"] != "value":
+        return {"type": snak["snaktype"]}
+    datavalue = snak["datavalue"]
+    content = datavalue["value"]
+    if datavalue["type"] == "wikibase-entityid":
+        content = content["id"]
+    return {"type": "value", "content": content}
+
+
+class EntityBatchFetcher:
+    ENDPOINT = "https://www.wikidata.org/w/api.php"
+    BATCH_SIZE = 50  # wbgetentities limit for non-bot users
     P_POPULATION = "P1082"
-    P_POINT_IN_TIME = "P585"
-    P_METHOD = "P459"
-    Q_ESTIMATION = "Q791801"
-    Q_CENSUS = "Q39825"
-    EDIT_SUMMARY = "fixing duplicate P1082 statements and P585 qualifiers"
-
-    def __init__(self, qid):
-        self.qid = qid
-        base_endpoint = (
-            "https://www.wikidata.org/w/rest.php/wikibase/v1/entities/items/"
-        )
-        self.endpoint = base_endpoint + qid
-        self.initial_commands = []
-        self.final_commands = []
-        # load initial
-        for cmd in ALL_INITIAL_COMMANDS:
-            if qid in cmd.split("|")[0]:
-                self.initial_commands.append(cmd)
-        # load final
-        res = requests.get(self.endpoint, headers=HEADERS)
-        res.raise_for_status()
-        entity = res.json()
-        statements = entity["statements"][self.P_POPULATION]
-        for st in statements:
-            if self.p585_count(st) > 1:
-                self.handle_duplicate_p585(st)
-        # add edit summary or print ok
-        if len(self.final_commands) == 0:
-            logging.info(f"[{self.qid}] OK!")
-        else:
-            self.final_commands[-1] += f"|/* {self.EDIT_SUMMARY} */"
-
-    def append_command(self, cmd):
-        self.final_commands.append(cmd)
-        logging.info(cmd)
-
-    def p585_count(self, st):
-        p585_count = 0
-        for qual in st["qualifiers"]:
-            pid = qual["property"]["id"]
-            if pid == self.P_POINT_IN_TIME:
-                p585_count += 1
-        return p585_count
-
-    def handle_duplicate_p585(self, st):
-        if self.p585_count(st) == 2:
-            idx_to_drop = None
-            idxs = []
-            for i, qual in enumerate(st["qualifiers"]):
-                pid = qual["property"]["id"]
-                if pid == self.P_POINT_IN_TIME:
-                    idxs.append(i)
-            assert len(idxs) == 2
-            idx_to_drop = self.idx_to_drop(st, idxs[0], idxs[1])
-            if idx_to_drop is not None:
-                qual = st["qualifiers"][idx_to_drop]
-                time = qual["value"]["content"]["time"]
-                precision = qual["value"]["content"]["precision"]
-                self.append_command(
-                    "|".join(
-                        [
-                            "REMOVE_QUAL",
-                            self.qid,
-                            self.P_POPULATION,
-                            st["value"]["content"]["amount"],
-                            self.P_POINT_IN_TIME,
-                            time + "/" + str(precision),
-                        ]
-                    )
-                )
-                return
-        # more complex situation, 2 complex or 3+ years
-        # remove current statement and redo for each year
-        p585_qualifiers = []
-        for qual in st["qualifiers"]:
-            pid = qual["property"]["id"]
-            if pid == self.P_POINT_IN_TIME:
-                p585_qualifiers.append(qual)
-        self.append_command(
-            "|".join(
-                [
-                    f"-{self.qid}",
-                    self.P_POPULATION,
-                    st["value"]["content"]["amount"],
-                ]
-            )
-        )
-        _years = list(set([q["value"]["content"]["time"][:5] for q in p585_qualifiers]))
-        years_left = {y: True for y in _years}
-        logging.info(f"removing statement above with years: {_years}")
-        # special case: census with 2000, 2010 + other values
-        if "+2010" in years_left.keys() and "+2000" in years_left.keys():
-            logging.info(
-                "2000 census already handled in other statement, removing it from here"
-            )
-            years_left.pop("+2000")
-        # special case: we don't have 2022 census data in result.qs
-        if "+2022" in years_left.keys() and len(years_left.keys()) == 2:
-            self.final_commands.pop(-1)
-            years_left.pop("+2022")
-            other_year = list(years_left.keys())[0]
-            cmd = None
-            for initial in self.initial_commands:
-                year = initial.split("|")[4][:5]
-                if year == other_year:
-                    cmd = initial
-                    break
-            if cmd is None:
-                raise ValueError(f"{other_year} not found")
-            parts = cmd.split("|")
-            self.append_command("|".join(["REMOVE_QUAL", *parts[0:5]]))
-            self.append_command("|".join(["REMOVE_QUAL", *parts[0:3], *parts[5:7]]))
-            self.append_command("|".join(["REMOVE_REF", *parts[0:3], *parts[7:9]]))
-            self.append_command(
-                "|".join(
-                    ["REMOVE_REF", *parts[0:3], parts[9], "+2025-08-29T00:00:00Z/11"]
-                )
-            )
-            self.append_command(initial)
-            years_left.pop(other_year)
-        for initial in self.initial_commands:
-            year = initial.split("|")[4][:5]
-            if year in years_left.keys():
-                self.append_command(initial)
-                years_left.pop(year)
-        if len(years_left.keys()) > 0:
-            raise ValueError(f"[{self.qid}] missing qs commands for years: {years_left.keys()}")
-
-    def idx_to_drop(self, st, idx_old, idx_new) -> Optional[int]:
-        qualifiers = st["qualifiers"]
-        qual1 = qualifiers[idx_old]
-        qual2 = qualifiers[idx_new]
-        value1 = qual1["value"]["content"]
-        value2 = qual2["value"]["content"]
-        year1 = value1["time"][:5]
-        year2 = value2["time"][:5]
-        if year1 == year2:
-            # years are the same
-            if value1["precision"] < value2["precision"]:
-                logging.debug(f"[{self.qid}] keep NEWEST, more precision")
-                return idx_old
-            else:
-                # equal precisions, equal value, return newest
-                # or idx_old has greater precision
-                logging.debug(f"[{self.qid}] keep OLDEST, more or equal precision")
-                return idx_new
+
+    def __init__(self, endpoint=ENDPOINT):
+        self.endpoint = endpoint
+
+    def batches(self, qids):
+        for i in range(0, len(qids), self.BATCH_SIZE):
+            yield qids[i : i + self.BATCH_SIZE]
+
+    async def fetch(self, client: "HttpClient", qids):
+        # returns QID -> P1082 statements (REST shape)
+        params = {
+            "action": "wbgetentities",
+            "ids": "|".join(qids),
+            "props": "claims",
+            "format": "json",
+        }
+        start = time.perf_counter()
+        data = await client.get_json(self.endpoint, params=params, headers=HEADERS)
+        METRICS.observe("wbgetentities", time.perf_counter() - start)
+        if "error" in data:
+            raise ValueError(f"wbgetentities failed: {data['error']}")
+        statements = {}
+        for qid, entity in data["entities"].items():
+            if "missing" in entity:
+                logging.warning(f"[{qid}] missing entity")
+                continue
+            claims = entity.get("claims", {}).get(self.P_POPULATION, [])
+            statements[qid] = [rest_statement(st) for st in claims]
+        return statements
+
+
+def analyse(items):
+    # QID -> P1082 statements (REST shape) to [(qid, commands, None) or
+    # (qid, None, reason)], see fix_rules.py
+    from fix_rules import analyse_items  # pandas, only when there is something to analyse
+
+    try:
+        return analyse_items(items, INITIAL_COMMANDS.for_qid)
+    except Exception as e:
+        logging.exception(f"analysis of {len(items)} items failed")
+        return [(qid, None, repr(e)) for qid in items]
+
+
+# Results of every item as soon as they are known, so that a run can be
+# resumed: done items go to the journal, failed ones (with the reason) to the
+# failures file, which is rewritten on each run since those are retried.
+class Journal:
+    def __init__(
+        self,
+        path="fix_populations.journal.jsonl",
+        failures_path="fix_populations.failures.jsonl",
+        resume=False,
+        name="fix",
+    ):
+        self.path = path
+        self.name = name  # of the counters in the run report
+        self.failures_path = failures_path
+        self.done = set()
+        entries = self.entries() if resume else []
+        # rewritten without a possibly half written last line
+        with open(self.path, "w") as f:
+            for entry in entries:
+                f.write(json.dumps(entry) + "\n")
+                self.done.add(entry["qid"])
+        if resume:
+            logging.info(f"resuming, {len(self.done)} items already done")
+        self.f = open(self.path, "a")
+        self.failures = open(self.failures_path, "w")
+
+    def entries(self):
+        if not os.path.exists(self.path):
+            return []
+        entries = []
+        with open(self.path, "r") as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    logging.warning(f"ignoring broken journal line: {line!r}")
+        return entries
+
+    def record(self, qid, commands, error):
+        if qid in self.done:
+            return
+        if error is None:
+            self.f.write(json.dumps({"qid": qid, "commands": commands}) + "\n")
+            self.f.flush()
+            self.done.add(qid)
+            METRICS.count(f"{self.name}.items")
+            METRICS.count(f"{self.name}.commands", len(commands))
         else:
-            if self.only_census(st) and year1 == "+2000" and year2 == "+2010":
-                # there's a lot of statements for census 2010 with a first qualifier = 2000, which can be removed
-                logging.debug(f"[{self.qid}] [CENSUS] keep 2010, oldest wrong (2010)")
-                return idx_old
-        return None
+            METRICS.count(f"{self.name}.failures")
+            self.failures.write(json.dumps({"qid": qid, "error": error}) + "\n")
+            self.failures.flush()
+
+    def assemble(self, output, shards: Optional[ShardWriter] = None):
+        # writes the commands of all done items sorted by QID, and to the
+        # shards when given
+        commands = {entry["qid"]: entry["commands"] for entry in self.entries()}
+        with open(output, "w") as f:
+            for qid in sorted(commands, key=lambda qid: int(qid[1:])):
+                for cmd in commands[qid]:
+                    f.write(cmd + "\n")
+                    if shards is not None:
+                        shards.add(cmd)
+        logging.info(f"{len(commands)} items written to {output}")
+
+    def close(self):
+        self.f.close()
+        self.failures.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def analyse_live(args, journal):
+    qids = [qid for qid in AllCitiesQid(refresh=args.refresh).qids() if qid not in journal.done]
+    asyncio.run(analyse_batches(qids, args, journal))
+
+
+async def analyse_batches(qids, args, journal):
+    from http_client import HttpClient
+
+    fetcher = EntityBatchFetcher()
 
-    def only_census(self, st) -> bool:
-        methods = []
-        for qual in st["qualifiers"]:
-            if qual["property"]["id"] == self.P_METHOD:
-                methods.append(qual["value"]["content"])
-        return list(set(methods)) == [self.Q_CENSUS]
+    async def fetch(batch):
+        try:
+            return batch, await fetcher.fetch(client, batch), None
+        except Exception as e:
+            logging.exception(f"fetching {batch[0]}..{batch[-1]} failed")
+            return batch, None, repr(e)
+
+    async with HttpClient(concurrency=args.concurrency, rate=args.rate) as client:
+        tasks = [fetch(batch) for batch in fetcher.batches(qids)]
+        for next_done in asyncio.as_completed(tasks):
+            batch, statements, error = await next_done
+            if error is not None:
+                for qid in batch:
+                    journal.record(qid, None, error)
+                continue
+            for result in analyse(statements):
+                journal.record(*result)
+
+
+# Wikidata JSON dumps are one big array with one entity per line
+
+
+def dump_chunks(path, chunk_size):
+    opener = {"gz": gzip.open, "bz2": bz2.open}.get(path.rsplit(".", 1)[-1], open)
+    chunk = []
+    with opener(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            # cheap filter before decoding any JSON
+            if '"P1585"' not in line:
+                continue
+            chunk.append(line)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+
+def analyse_dump_chunk(lines):
+    items = {}
+    for line in lines:
+        line = line.strip().rstrip(",")
+        if line in ("", "[", "]"):
+            continue
+        entity = json.loads(line)
+        claims = entity.get("claims", {})
+        if "P1585" not in claims:
+            continue
+        statements = [rest_statement(st) for st in claims.get("P1082", [])]
+        items[entity["id"]] = statements
+    return analyse(items)
+
+
+def analyse_dump(args, journal):
+    # at most 2 chunks per worker are in memory at once
+    jobs = args.jobs or os.cpu_count()
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        pending = deque()
+        for chunk in dump_chunks(args.dump, args.chunk_size):
+            pending.append(executor.submit(analyse_dump_chunk, chunk))
+            while len(pending) >= 2 * jobs or (pending and pending[0].done()):
+                for result in pending.popleft().result():
+                    journal.record(*result)
+        while pending:
+            for result in pending.popleft().result():
+                journal.record(*result)
+
+
+# also the options of `python main.py fix`
+def run(args):
+    with METRICS.reporting(args):
+        with Journal(resume=args.resume) as journal, METRICS.timer("fix"):
+            if args.dump:
+                analyse_dump(args, journal)
+            else:
+                analyse_live(args, journal)
+        shard_writer = ShardWriter.from_args(args, prefix="fix_populations")
+        with METRICS.timer("write"), (shard_writer or contextlib.nullcontext()) as shards:
+            journal.assemble("fix_populations.qs", shards)
 
 
 def main():
-    qids = AllCitiesQid().qids()
-    with ThreadPoolExecutor() as executor:
-        results = executor.map(lambda x: JsonQid(x), qids)
-    with open("fix_populations.qs", "w") as f:
-        for jqid in results:
-            for cmd in jqid.final_commands:
-                f.write(cmd + "\n")
+    parser = argparse.ArgumentParser()
+    add_fix_arguments(parser)
+    run(parser.parse_args())
 
 
 if __name__ == "__main__":
@@ -0,0 +1,210 @@
+import logging
+
+import numpy as np
+import pandas as pd
+
+from commands import REMOVE
+from commands import REMOVE_QUAL
+from commands import REMOVE_REF
+from commands import Command
+
+# Duplicate P585 analysis of many items at once: the P1082 statements are
+# flattened into one qualifier table, and the statements with several P585
+# qualifiers are found and classified with grouped operations over the whole
+# table, following the rule tables below. Only the commands of the statements
+# that need fixing are built one by one.
+
+P_POPULATION = "P1082"
+P_POINT_IN_TIME = "P585"
+P_METHOD = "P459"
+Q_CENSUS = "Q39825"
+S_RETRIEVED = "S813"
+EDIT_SUMMARY = "fixing duplicate P1082 statements and P585 qualifiers"
+# S813 of the references removed from re-qualified statements
+RETRIEVED = "+2025-08-29T00:00:00Z/11"
+
+# Statements with exactly two P585 qualifiers: the first rule whose conditions
+# (columns of pairs(), "old" is the first qualifier, "new" the second) all hold
+# says which qualifier is removed.
+DROP_RULES = [
+    ("same year, the new one is more precise", {"same_year": True, "new_more_precise": True}, "old"),
+    ("same year, the old one is as precise or more", {"same_year": True}, "new"),
+    ("census with 2000 then 2010, 2000 is a mistake", {"only_census": True, "year_old": "+2000", "year_new": "+2010"}, "old"),
+]
+
+# The other statements are removed and added again once per year, from the
+# result.qs commands. These rules apply in order to their set of years, when
+# it has all the `years` (and exactly `count` years if not None):
+#   ("forget", year)     that year is not re-added
+#   ("requalify", year)  that year is dropped and, instead of removing the
+#                        statement, the qualifiers and references of the other
+#                        (single) year are replaced in place
+YEAR_RULES = [
+    ("2000 census already handled in another statement", ("+2000", "+2010"), None, ("forget", "+2000")),
+    ("no 2022 census data in result.qs", ("+2022",), 2, ("requalify", "+2022")),
+]
+
+
+def flatten(items):
+    # QID -> P1082 statements (REST shape) as a statement table (qid, amount)
+    # and a qualifier table (statement, position, property, time, precision,
+    # method) with only the P585 and P459 qualifiers
+    st_qids, amounts = [], []
+    q_statements, positions, properties, times, precisions, methods = [], [], [], [], [], []
+    for qid, statements in items.items():
+        for st in statements:
+            i = len(st_qids)
+            st_qids.append(qid)
+            amounts.append(st["value"]["content"]["amount"])
+            for position, qual in enumerate(st["qualifiers"]):
+                pid = qual["property"]["id"]
+                if pid not in (P_POINT_IN_TIME, P_METHOD):
+                    continue
+                content = qual["value"].get("content")
+                q_statements.append(i)
+                positions.append(position)
+                properties.append(pid)
+                if pid == P_POINT_IN_TIME:
+                    times.append(content["time"] if content else None)
+                    precisions.append(content["precision"] if content else -1)
+                    methods.append(None)
+                else:
+                    times.append(None)
+                    precisions.append(-1)
+                    methods.append(content)
+    statements = pd.DataFrame({"qid": st_qids, "amount": amounts})
+    qualifiers = pd.DataFrame({
+        "statement": np.array(q_statements, dtype=np.int64),
+        "position": np.array(positions, dtype=np.int64),
+        "property": properties,
+        "time": times,
+        "precision": np.array(precisions, dtype=np.int64),
+        "method": methods,
+    })
+    return statements, qualifiers
+
+
+def only_census(qualifiers):
+    # statement -> whether all its methods are census (and it has some)
+    methods = qualifiers[qualifiers["property"] == P_METHOD]
+    census = (methods["method"] == Q_CENSUS).groupby(methods["statement"]).all()
+    return census
+
+
+def pairs(p585, census):
+    # one row per statement with exactly two P585 qualifiers
+    nth = p585.groupby("statement").cumcount()
+    old = p585[nth == 0].set_index("statement")
+    new = p585[nth == 1].set_index("statement")
+    pairs = pd.DataFrame(index=old.index)
+    pairs["year_old"] = old["time"].str[:5]
+    pairs["year_new"] = new["time"].str[:5]
+    pairs["same_year"] = pairs["year_old"] == pairs["year_new"]
+    pairs["new_more_precise"] = old["precision"] < new["precision"]
+    pairs["only_census"] = census.reindex(pairs.index, fill_value=False)
+    pairs["drop"] = None
+    for _, conditions, which in DROP_RULES:
+        mask = pairs["drop"].isna()
+        for column, value in conditions.items():
+            mask &= pairs[column] == value
+        pairs.loc[mask, "drop"] = which
+    dropped_old = pairs["drop"] == "old"
+    pairs["time"] = old["time"].where(dropped_old, new["time"])
+    pairs["precision"] = old["precision"].where(dropped_old, new["precision"])
+    return pairs
+
+
+def years(p585):
+    # statement x year presence table after YEAR_RULES, and the statements to re-qualify
+    present = (
+        p585.assign(year=p585["time"].str[:5], present=True)
+        .drop_duplicates(["statement", "year"])
+        .pivot(index="statement", columns="year", values="present")
+        .notna()
+    )
+    rule_years = {y for _, required, _, (_, year) in YEAR_RULES for y in (*required, year)}
+    present = present.reindex(columns=present.columns.union(sorted(rule_years)), fill_value=False)
+    count = present.sum(axis=1)
+    requalify = pd.Series(False, index=present.index)
+    for _, required, n, (action, year) in YEAR_RULES:
+        mask = present[list(required)].all(axis=1)
+        if n is not None:
+            mask &= count == n
+        count -= mask & present[year]
+        present.loc[mask, year] = False
+        if action == "requalify":
+            requalify |= mask
+    return present, requalify
+
+
+def requalify_commands(cmd: Command):
+    # replaces the P585/P459 qualifiers and the references of the statement of
+    # the result.qs command cmd, then adds them again with cmd
+    statement = (cmd.item, cmd.property, cmd.value)
+    removals = [Command(REMOVE_QUAL, *statement, qualifiers=(qualifier,)) for qualifier in cmd.qualifiers]
+    removals += [
+        Command(REMOVE_REF, *statement, references=((pid, RETRIEVED if pid == S_RETRIEVED else value),))
+        for pid, value in cmd.references
+    ]
+    return [*removals, cmd]
+
+
+def analyse_items(items, initial_commands):
+    # items: QID -> P1082 statements (REST shape), initial_commands: QID ->
+    # (year -> result.qs Command). Returns (qid, commands, None), the commands
+    # as QuickStatements lines, or (qid, None, reason) when an item cannot be
+    # fixed, for every item.
+    statements, qualifiers = flatten(items)
+    p585 = qualifiers[qualifiers["property"] == P_POINT_IN_TIME].sort_values(["statement", "position"])
+    counts = p585["statement"].value_counts()
+    p585 = p585[p585["statement"].isin(counts.index[counts > 1])]
+    qids = statements["qid"].tolist()
+    amounts = statements["amount"].tolist()
+    commands = {}  # statement -> commands
+    errors = {}  # qid -> reason
+
+    for statement in p585.loc[p585["time"].isna(), "statement"].unique():
+        errors.setdefault(qids[statement], "P585 qualifier without a value")
+
+    two = pairs(p585[p585["statement"].isin(counts.index[counts == 2])], only_census(qualifiers))
+    dropped = two[two["drop"].notna()]
+    for statement, time, precision in zip(dropped.index, dropped["time"], dropped["precision"]):
+        qid, amount = qids[statement], amounts[statement]
+        qualifier = (P_POINT_IN_TIME, f"{time}/{precision}")
+        commands[statement] = [Command(REMOVE_QUAL, qid, P_POPULATION, amount, qualifiers=(qualifier,))]
+
+    present, requalify = years(p585[~p585["statement"].isin(dropped.index)])
+    year_names = present.columns.to_numpy()
+    for statement, row, requalified in zip(present.index, present.to_numpy(), requalify.to_numpy()):
+        qid, amount = qids[statement], amounts[statement]
+        left = year_names[row].tolist()
+        initial = initial_commands(qid)
+        if requalified:
+            cmd = initial.get(left[0])
+            if cmd is None:
+                errors.setdefault(qid, f"{left[0]} not found")
+                continue
+            commands[statement] = requalify_commands(cmd)
+            continue
+        missing = [year for year in left if year not in initial]
+        if missing:
+            errors.setdefault(qid, f"missing qs commands for years: {missing}")
+            continue
+        commands[statement] = [Command(REMOVE, qid, P_POPULATION, amount)]
+        commands[statement] += [cmd for year, cmd in initial.items() if year in left]
+
+    by_qid = {}
+    for statement in sorted(commands):
+        by_qid.setdefault(qids[statement], []).extend(commands[statement])
+    results = []
+    for qid in items:
+        if qid in errors:
+            logging.warning(f"[{qid}] {errors[qid]}")
+            results.append((qid, None, errors[qid]))
+            continue
+        item_commands = by_qid.get(qid, [])
+        if item_commands:
+            item_commands[-1] = item_commands[-1].with_summary(EDIT_SUMMARY)
+        results.append((qid, [cmd.serialize() for cmd in item_commands], None))
+    logging.debug(f"{len(items)} items, {len(commands)} statements to fix, {len(errors)} failed")
+    return results
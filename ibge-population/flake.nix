@@ -10,8 +10,10 @@
     devShells.${system}.default = pkgs.mkShell {
       packages = with pkgs; [
         python312
-        python312Packages.requests
+        python312Packages.aiohttp
+        python312Packages.numpy
         python312Packages.pandas
+        python312Packages.pyarrow
         python312Packages.odfpy
         python312Packages.xlrd
         python312Packages.openpyxl
@@ -0,0 +1,46 @@
+import os
+import json
+import hashlib
+import logging
+
+from metrics import METRICS
+
+CACHE_DIR = "./data/cache/frames"
+# bump when the cleaning code in Estimate.df/Census.df changes
+VERSION = 1
+
+
+def file_digest(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def cache_key(path, params):
+    h = hashlib.sha256()
+    h.update(file_digest(path).encode())
+    h.update(
+        json.dumps({"version": VERSION, **params}, sort_keys=True, ensure_ascii=False).encode()
+    )
+    return h.hexdigest()[:32]
+
+
+def cached_frame(path, params, parse, cache_dir=CACHE_DIR):
+    # parse() is only called when there is no cached frame for this file and params
+    import pyarrow.feather as feather  # not needed by the file_digest() users
+
+    cache_path = os.path.join(cache_dir, cache_key(path, params) + ".feather")
+    if os.path.exists(cache_path):
+        logging.info(f"using cached frame for {path}: {cache_path}")
+        METRICS.count("frame_cache.hits")
+        return feather.read_table(cache_path, memory_map=True).to_pandas()
+    METRICS.count("frame_cache.misses")
+    df = parse().reset_index(drop=True)
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp = cache_path + ".tmp"
+    # uncompressed, so that it can be memory-mapped
+    feather.write_feather(df, tmp, compression="uncompressed")
+    os.replace(tmp, cache_path)
+    return df
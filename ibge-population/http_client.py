@@ -0,0 +1,236 @@
+import asyncio
+import contextlib
+import email.utils
+import logging
+import os
+import random
+import time
+from typing import Optional
+
+import aiohttp
+
+from metrics import METRICS
+
+HEADERS = {
+    "User-Agent": "arcstur/wikidata-scripts (https://github.com/arcstur/wikidata-scripts)",
+}
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        # rate: tokens per second, capacity: burst size
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def retry_after(response) -> Optional[float]:
+    value = response.headers.get("Retry-After")
+    if value is None:
+        return None
+    if value.isdigit():
+        return float(value)
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+class HttpClient:
+    # Shared client: one pooled connection set per host, at most `concurrency`
+    # requests in flight, at most `rate` requests per second, and retries with
+    # exponential backoff on connection errors, 429 and 5xx (honouring Retry-After).
+    def __init__(
+        self,
+        concurrency=8,
+        rate=10.0,
+        max_retries=5,
+        backoff=1.0,
+        max_backoff=60.0,
+        timeout=300,
+        headers=HEADERS,
+    ):
+        self.concurrency = concurrency
+        self.rate = rate
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.headers = headers
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(
+            limit=self.concurrency, limit_per_host=self.concurrency
+        )
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            headers=self.headers,
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+        )
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        self.bucket = TokenBucket(self.rate)
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.session.close()
+
+    def delay(self, attempt):
+        delay = min(self.max_backoff, self.backoff * 2**attempt)
+        return delay * (0.5 + random.random() / 2)
+
+    async def send(self, method, url, retry=True, **kwargs):
+        # returns the response (not yet read) once it is not retryable anymore;
+        # the "http" latency histogram is the time to the response headers.
+        # retry=False for requests that must not be sent twice (edits): the
+        # first error or response is the caller's to handle
+        max_retries = self.max_retries if retry else 0
+        attempt = 0
+        while True:
+            await self.bucket.acquire()
+            METRICS.count("http.requests")
+            start = time.perf_counter()
+            try:
+                response = await self.session.request(method, url, **kwargs)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                METRICS.count("http.errors")
+                if attempt >= max_retries:
+                    raise
+                delay = self.delay(attempt)
+                logging.warning(f"{method} {url} failed ({e!r}), retrying in {delay:.1f}s")
+            else:
+                METRICS.observe("http", time.perf_counter() - start)
+                if response.status not in RETRY_STATUSES or attempt >= max_retries:
+                    return response
+                delay = retry_after(response)
+                if delay is None:
+                    delay = self.delay(attempt)
+                response.release()
+                logging.warning(
+                    f"{method} {url} returned {response.status}, retrying in {delay:.1f}s"
+                )
+            attempt += 1
+            METRICS.count("http.retries")
+            await asyncio.sleep(delay)
+
+    @contextlib.asynccontextmanager
+    async def request(self, method, url, retry=True, **kwargs):
+        async with self.semaphore:
+            response = await self.send(method, url, retry=retry, **kwargs)
+            try:
+                yield response
+            finally:
+                response.release()
+
+    async def get_bytes(self, url, **kwargs):
+        async with self.request("GET", url, **kwargs) as response:
+            response.raise_for_status()
+            return await response.read()
+
+    async def get_json(self, url, **kwargs):
+        async with self.request("GET", url, **kwargs) as response:
+            response.raise_for_status()
+            return await response.json(content_type=None)
+
+    async def iter_lines(self, url, **kwargs):
+        # the body line by line (with the b"\n") as it arrives
+        async with self.request("GET", url, **kwargs) as response:
+            response.raise_for_status()
+            async for line in response.content:
+                yield line
+
+    async def download(self, url, path, headers=None, chunk_size=1 << 16):
+        # Streams url into path + ".part" and renames it to path when complete.
+        # A left over .part file is resumed with a Range request, also when the
+        # connection drops mid-body. Returns the response headers, or None when
+        # the server answers 304 to the conditional headers.
+        part = path + ".part"
+        validator_path = part + ".validator"
+        attempt = 0
+        while True:
+            offset = os.path.getsize(part) if os.path.exists(part) else 0
+            request_headers = dict(headers or {})
+            if offset and os.path.exists(validator_path):
+                # If-Range: the server sends the whole file if it changed since
+                with open(validator_path, "r") as f:
+                    request_headers["If-Range"] = f.read()
+                request_headers["Range"] = f"bytes={offset}-"
+            try:
+                async with self.request("GET", url, headers=request_headers) as response:
+                    if response.status == 304:
+                        return None
+                    if response.status == 416:
+                        logging.warning(f"cannot resume {part}, downloading it again")
+                        os.remove(part)
+                        continue
+                    response.raise_for_status()
+                    resumed = response.status == 206 and content_range_start(response) == offset
+                    if offset and not resumed:
+                        logging.warning(f"server ignored the range, downloading {url} again")
+                    if not resumed:
+                        validator = response.headers.get("ETag") or response.headers.get("Last-Modified")
+                        if validator:
+                            with open(validator_path, "w") as f:
+                                f.write(validator)
+                        elif os.path.exists(validator_path):
+                            os.remove(validator_path)
+                    with open(part, "ab" if resumed else "wb") as f:
+                        async for chunk in response.content.iter_chunked(chunk_size):
+                            f.write(chunk)
+                    os.replace(part, path)
+                    if os.path.exists(validator_path):
+                        os.remove(validator_path)
+                    return response.headers
+            except (aiohttp.ClientPayloadError, aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = self.delay(attempt)
+                logging.warning(f"download of {url} interrupted ({e!r}), resuming in {delay:.1f}s")
+                attempt += 1
+                METRICS.count("http.retries")
+                await asyncio.sleep(delay)
+
+
+def content_range_start(response) -> Optional[int]:
+    # "bytes 100-199/200" -> 100
+    value = response.headers.get("Content-Range", "")
+    if not value.startswith("bytes ") or "-" not in value:
+        return None
+    start = value[len("bytes "):].split("-", 1)[0]
+    return int(start) if start.isdigit() else None
+
+
+def fetch_json(url, **kwargs):
+    # for one-off requests from synchronous code
+    async def fetch():
+        async with HttpClient() as client:
+            return await client.get_json(url, **kwargs)
+
+    return asyncio.run(fetch())
+
+
+def fetch_lines(url, add_line, **kwargs):
+    # same, calling add_line(line) for every line as the body streams in
+    async def fetch():
+        async with HttpClient() as client:
+            async for line in client.iter_lines(url, **kwargs):
+                add_line(line)
+
+    asyncio.run(fetch())
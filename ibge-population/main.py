@@ -1,39 +1,176 @@
+import argparse
+import contextlib
 import logging
-import sys
 
-from estimates import ESTIMATE_YEARS
-from census import CENSUS_LIST
-from wikidata import EstimateToQs
-from wikidata import CensusToQs
+from arguments import add_fix_arguments
+from arguments import add_write_arguments
+from metrics import METRICS
+from metrics import add_arguments
+from shards import ShardWriter
+from shards import add_shard_arguments
+
+# python3 main.py <command> ...: each command imports the modules it needs
+# (pandas, the spreadsheet readers, the source lists) only when it runs
 
-def sort_key(cmd):
-    qid = cmd.split("|")[0]
-    year = cmd.split("|")[4][:5]
-    return qid + year
 
 def main():
     logging.basicConfig(level="INFO")
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest="command", metavar="command", required=True)
+    for what, help in (
+        ("estimates", "QS commands for the population estimates"),
+        ("census", "QS commands for the censuses"),
+        ("both", "QS commands for the estimates and the censuses"),
+    ):
+        sub = commands.add_parser(what, help=help)
+        sub.add_argument("--refresh", action="store_true", help="ignore the cached P1585 mapping")
+        sub.add_argument("--jobs", type=int, default=None, help="processes parsing estimates (default: all cores)")
+        sub.add_argument("--memory-budget", type=int, default=256, help="MiB of commands kept in memory while sorting")
+        sub.add_argument("--delta", action="store_true", help="only write statements not emitted by previous --delta runs")
+        sub.add_argument("--skip-existing", action="store_true", help="leave out statements Wikidata already has")
+        add_shard_arguments(sub, prefix="result")
+        add_arguments(sub, report="./report.json")
+        sub.set_defaults(run=run_qs)
+    sub = commands.add_parser("panel", help="the code x date population matrix the QS commands are emitted from (data/panel)")
+    sub.add_argument("--jobs", type=int, default=None, help="processes parsing estimates (default: all cores)")
+    add_arguments(sub, report="./report.json")
+    sub.set_defaults(run=run_panel)
+    sub = commands.add_parser("fix", help="fix duplicate P585 qualifiers, same as fix_populations.py")
+    add_fix_arguments(sub)
+    sub.set_defaults(run=run_fix)
+    sub = commands.add_parser("write", help="submit .qs commands with one wbeditentity edit per item")
+    add_write_arguments(sub)
+    sub.set_defaults(run=run_write)
+    args = parser.parse_args()
+    args.run(args)
+
+
+def run_fix(args):
+    import fix_populations
+
+    fix_populations.run(args)
+
+
+def run_write(args):
+    import wbedit
+
+    wbedit.run(args)
+
+
+def run_panel(args):
+    from estimates import ESTIMATE_YEARS
+    from estimates import download_all
+    from census import CENSUS_LIST
+
+    with METRICS.reporting(args):
+        download_all(ESTIMATE_YEARS)
+        population_panel(ESTIMATE_YEARS, CENSUS_LIST, args.jobs)
+        logging.info("population panel written to ./data/panel")
+
+
+def population_panel(estimates, censuses, jobs=None):
+    # the memory-mapped panel of these sources, only parsed and built again
+    # when data/panel was built from other sources or other files
+    from estimates import load_populations
+    from panel import Panel
+
+    panel = Panel.load_fresh([*censuses, *estimates])
+    if panel is not None:
+        logging.info("using the population panel in ./data/panel")
+        return panel
+    load_populations(estimates, jobs)
+    with METRICS.timer("parse"):
+        for census in censuses:
+            census.df()
+    with METRICS.timer("panel"):
+        Panel.build(estimates, censuses).save()
+    return Panel.load()
+
+
+def run_qs(args):
+    from estimates import ESTIMATE_YEARS
+    from estimates import download_all
+    from census import CENSUS_LIST
+    from delta import Snapshot
+    from existing import ExistingStatements
+    from external_sort import ExternalSorter
+    from wikidata import EstimateToQs
+    from wikidata import CensusToQs
+    from wikidata import IbgeCodeToQid
+    from wikidata import sorted_commands
+
     result = "./result.qs"
-    full_qs_list = []
-
-    what = sys.argv[1] if len(sys.argv) > 1 else ""
-    if what in ("estimates", "both"):
-        eqs = EstimateToQs()
-        for estimate in ESTIMATE_YEARS:
-            estimate.download()
-            full_qs_list.extend(eqs.to_qs_list(estimate))
-    if what in ("census", "both"):
-        cqs = CensusToQs()
-        for c in CENSUS_LIST:
-            full_qs_list.extend(cqs.to_qs_list(c))
-    elif what not in ("census", "estimates", "both"):
-        raise ValueError(f"argument must be 'estimates', 'census' or 'both', it's {what}")
-
-    full_qs_list = sorted(full_qs_list, key=sort_key)
-    with open(result, "w") as f:
-        f.write("\n".join(full_qs_list) + "\n")
+    new_result = "./result.new.qs"
+    what = args.command
+    snapshot = Snapshot() if args.delta else None
+    existing = ExistingStatements().load() if args.skip_existing else None
+    # result.qs always has every statement (fix_populations reads it back),
+    # what --delta and --skip-existing leave for submitting goes to result.new.qs
+    filtered = snapshot is not None or existing is not None
+    budget = args.memory_budget * 2**20 // (2 if filtered else 1)
+
+    def new_rows(source, df):
+        if snapshot is not None:
+            if snapshot.unchanged(source):
+                logging.info(f"{source.source_id()}: input unchanged, no new statements")
+                return df.iloc[:0]
+            new = snapshot.changed(source, df)
+            snapshot.update(source, df, panel)
+            df = new
+        if existing is not None:
+            df = existing.missing(df)
+        return df
+
+    def add(source, df):
+        with METRICS.timer("sort"):
+            sorter.add_run(sorted_commands(df))
+            if new_sorter is not None:
+                new = new_rows(source, df)
+                new_sorter.add_run(sorted_commands(new))
+                METRICS.count("new_commands", len(new))
+        METRICS.count("commands", len(df))
+
+    with contextlib.ExitStack() as stack:
+        stack.enter_context(METRICS.reporting(args))
+        sorter = stack.enter_context(ExternalSorter(memory_budget=budget))
+        new_sorter = stack.enter_context(ExternalSorter(memory_budget=budget)) if filtered else None
+        estimates = ESTIMATE_YEARS if what in ("estimates", "both") else []
+        censuses = CENSUS_LIST if what in ("census", "both") else []
+        if estimates:
+            download_all(estimates)
+        panel = population_panel(estimates, censuses, args.jobs)
+        for estimate in estimates:
+            eqs = EstimateToQs(IbgeCodeToQid.shared(refresh=args.refresh))
+            with METRICS.timer("emit"):
+                df = eqs.to_qs_frame(estimate, panel)
+            add(estimate, df)
+        for c in censuses:
+            cqs = CensusToQs(IbgeCodeToQid.shared(refresh=args.refresh))
+            with METRICS.timer("emit"):
+                df = cqs.to_qs_frame(c, panel)
+            add(c, df)
+
+        # the shards split what is to be submitted
+        shard_writer = ShardWriter.from_args(args, prefix="result")
+        shards = stack.enter_context(shard_writer or contextlib.nullcontext())
+        with METRICS.timer("write"):
+            write_commands(result, sorter, shards if new_sorter is None else None)
+            if new_sorter is not None:
+                write_commands(new_result, new_sorter, shards)
+        if snapshot is not None:
+            snapshot.save()
+        if filtered:
+            logging.info(f"statements left to submit written to {new_result}")
     logging.info(f"QuickStatements command written to {result}, sorted by QID")
 
 
+def write_commands(path, commands, shards=None):
+    with open(path, "w") as f:
+        for cmd in commands:
+            f.write(cmd + "\n")
+            if shards is not None:
+                shards.add(cmd)
+
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,51 @@
+import os
+import json
+
+from frame_cache import file_digest
+
+
+# Checksums (and HTTP validators) of the files in one directory, kept in
+# <directory>/manifest.json
+class Manifest:
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = os.path.join(directory, "manifest.json")
+        self.entries = {}
+        if os.path.exists(self.path):
+            with open(self.path, "r") as f:
+                self.entries = json.load(f)
+
+    def key(self, path):
+        return os.path.relpath(path, self.directory)
+
+    def record(self, path, **meta):
+        self.entries[self.key(path)] = {
+            "sha256": file_digest(path),
+            "size": os.path.getsize(path),
+            **meta,
+        }
+        self.save()
+
+    def verify(self, path):
+        entry = self.entries.get(self.key(path))
+        if entry is None or not os.path.exists(path):
+            return False
+        if os.path.getsize(path) != entry["size"]:
+            return False
+        return file_digest(path) == entry["sha256"]
+
+    def conditional_headers(self, path):
+        entry = self.entries.get(self.key(path), {})
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def save(self):
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.entries, f, indent=2, sort_keys=True)
+        os.replace(tmp, self.path)
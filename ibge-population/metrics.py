@@ -0,0 +1,173 @@
+import os
+import json
+import time
+import pstats
+import cProfile
+import logging
+import threading
+import contextlib
+import tracemalloc
+from bisect import bisect_left
+from datetime import datetime, timezone
+
+# Stage timers, counters and latency histograms of one run, written as a JSON
+# report at the end. Stages given to --profile also run under cProfile or
+# tracemalloc. Only the main process is measured: what happens inside worker
+# processes (parallel parsing, dump analysis) only shows in the stage timers.
+
+PROFILE_DIR = "./data/profile"
+PROFILERS = ("cprofile", "tracemalloc")
+# upper bounds in seconds of the latency histogram buckets, plus one open bucket
+BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TOP = 20  # functions (cProfile) or lines (tracemalloc) kept in the report
+
+
+class Metrics:
+    def __init__(self):
+        self.started = time.time()
+        self.lock = threading.Lock()
+        self.timers = {}  # stage -> {"seconds": total, "calls": n}
+        self.counters = {}
+        self.histograms = {}  # name -> {"counts": per bucket, "total": seconds, "max": seconds}
+        self.profile = set()
+        self.profiler = "cprofile"
+        self.profile_dir = PROFILE_DIR
+        self.profiles = {}
+        self.profiling = None  # stage being profiled, profiles do not nest
+
+    def configure(self, args):
+        # from the options added by add_arguments()
+        self.profile = set(args.profile or [])
+        self.profiler = args.profiler
+
+    @contextlib.contextmanager
+    def reporting(self, args):
+        # a whole run: configured from the add_arguments() options, the report
+        # is written at the end even when the run fails
+        self.configure(args)
+        try:
+            yield
+        finally:
+            self.write(args.report)
+
+    @contextlib.contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            if stage in self.profile and self.profiling is None:
+                self.profiling = stage
+                try:
+                    with self.profiled(stage):
+                        yield
+                finally:
+                    self.profiling = None
+            else:
+                if stage in self.profile:
+                    logging.warning(f"not profiling {stage}, it runs inside {self.profiling}")
+                yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                timer = self.timers.setdefault(stage, {"seconds": 0.0, "calls": 0})
+                timer["seconds"] += elapsed
+                timer["calls"] += 1
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def observe(self, name, seconds):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = {"counts": [0] * (len(BUCKETS) + 1), "total": 0.0, "max": 0.0}
+                self.histograms[name] = histogram
+            histogram["counts"][bisect_left(BUCKETS, seconds)] += 1
+            histogram["total"] += seconds
+            histogram["max"] = max(histogram["max"], seconds)
+
+    @contextlib.contextmanager
+    def profiled(self, stage):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        if self.profiler == "tracemalloc":
+            tracing = tracemalloc.is_tracing()
+            if not tracing:
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            try:
+                yield
+            finally:
+                _, peak = tracemalloc.get_traced_memory()
+                snapshot = tracemalloc.take_snapshot()
+                if not tracing:
+                    tracemalloc.stop()
+                path = os.path.join(self.profile_dir, f"{stage}.tracemalloc")
+                snapshot.dump(path)
+                self.profiles[stage] = {
+                    "profiler": "tracemalloc",
+                    "path": path,
+                    "peak_mib": peak / 2**20,
+                    "top": [
+                        {"line": str(stat.traceback), "kib": stat.size / 1024, "blocks": stat.count}
+                        for stat in snapshot.statistics("lineno")[:TOP]
+                    ],
+                }
+        else:
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                yield
+            finally:
+                profiler.disable()
+                path = os.path.join(self.profile_dir, f"{stage}.prof")
+                profiler.dump_stats(path)
+                stats = pstats.Stats(profiler).stats
+                top = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)[:TOP]
+                self.profiles[stage] = {
+                    "profiler": "cprofile",
+                    "path": path,
+                    "top": [
+                        {"function": f"{file}:{line}({name})", "calls": calls, "tottime": tottime, "cumtime": cumtime}
+                        for (file, line, name), (_, calls, tottime, cumtime, _) in top
+                    ],
+                }
+        logging.info(f"profile of {stage} written to {self.profiles[stage]['path']}")
+
+    def report(self):
+        with self.lock:
+            return {
+                "started": datetime.fromtimestamp(self.started, timezone.utc).isoformat(timespec="seconds"),
+                "seconds": time.time() - self.started,
+                "timers": self.timers,
+                "counters": self.counters,
+                "histograms": {
+                    name: {
+                        "buckets": [*BUCKETS, None],  # upper bounds, None is +inf
+                        **histogram,
+                        "mean": histogram["total"] / max(1, sum(histogram["counts"])),
+                    }
+                    for name, histogram in self.histograms.items()
+                },
+                "profiles": self.profiles,
+            }
+
+    def write(self, path):
+        report = self.report()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        os.replace(tmp, path)
+        stages = ", ".join(f"{stage} {timer['seconds']:.1f}s" for stage, timer in report["timers"].items())
+        logging.info(f"run report written to {path} ({stages})")
+
+
+def add_arguments(parser, report):
+    parser.add_argument("--report", default=report, help=f"where to write the JSON run report (default: {report})")
+    parser.add_argument("--profile", action="append", metavar="STAGE", help="profile this stage (repeatable)")
+    parser.add_argument("--profiler", choices=PROFILERS, default="cprofile", help=f"output in {PROFILE_DIR}")
+
+
+METRICS = Metrics()
@@ -0,0 +1,220 @@
+import zipfile
+import xml.etree.ElementTree as ET
+from collections import deque
+
+import pandas as pd
+
+# Streaming reader for the sheets of IBGE estimate ODS files. It reads
+# content.xml incrementally and only keeps the current row in memory, but
+# mimics what pd.read_excel(..., dtype=str) with odfpy returns: repeated rows
+# and columns are expanded, trailing empty rows/cells are dropped, skiprows
+# counts raw rows, the header is the first row after them, and skipfooter
+# drops the last rows.
+
+TABLE = "{urn:oasis:names:tc:opendocument:xmlns:table:1.0}"
+OFFICE = "{urn:oasis:names:tc:opendocument:xmlns:office:1.0}"
+TEXT = "{urn:oasis:names:tc:opendocument:xmlns:text:1.0}"
+
+T_TABLE = TABLE + "table"
+T_NAME = TABLE + "name"
+T_ROW = TABLE + "table-row"
+T_CELL = TABLE + "table-cell"
+T_COVERED_CELL = TABLE + "covered-table-cell"
+T_ROWS_REPEATED = TABLE + "number-rows-repeated"
+T_COLUMNS_REPEATED = TABLE + "number-columns-repeated"
+O_VALUE_TYPE = OFFICE + "value-type"
+O_ANNOTATION = OFFICE + "annotation"
+TEXT_S = TEXT + "s"
+TEXT_C = TEXT + "c"
+
+# pandas' default NA strings
+NA_VALUES = {
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan",
+    "1.#IND", "1.#QNAN", "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a",
+    "nan", "null",
+}
+
+
+def cell_value(cell):
+    if cell.tag == T_COVERED_CELL:
+        return ""
+    value_type = cell.get(O_VALUE_TYPE)
+    if value_type is None:
+        return ""
+    if value_type == "float":
+        value = float(cell.get(OFFICE + "value"))
+        return str(int(value)) if value.is_integer() else str(value)
+    if value_type in ("percentage", "currency"):
+        return str(float(cell.get(OFFICE + "value")))
+    if value_type == "boolean":
+        return str(cell.get(OFFICE + "boolean-value") == "true")
+    if value_type == "date":
+        value = cell.get(OFFICE + "date-value").replace("T", " ")
+        return value if len(value) > 10 else value + " 00:00:00"
+    if value_type == "time":
+        return cell.get(OFFICE + "time-value")
+    # string: paragraphs are joined without separator, like odfpy does
+    return string_value(cell)
+
+
+def string_value(el):
+    # text of a cell like pandas' _get_cell_string_value: text:s are spaces
+    # at any depth, comments (office:annotation) are not part of the value
+    parts = [el.text.strip("\n")] if el.text else []
+    for child in el:
+        if child.tag == TEXT_S:
+            parts.append(" " * int(child.get(TEXT_C, 1)))
+        elif child.tag != O_ANNOTATION:
+            parts.append(string_value(child))
+        if child.tail:
+            parts.append(child.tail.strip("\n"))
+    return "".join(parts)
+
+
+def iter_cells(row):
+    # (first column index, repeat, cell) for each cell of the row
+    col = 0
+    for cell in row:
+        if cell.tag != T_CELL and cell.tag != T_COVERED_CELL:
+            continue
+        repeat = int(cell.get(T_COLUMNS_REPEATED, 1))
+        yield col, repeat, cell
+        col += repeat
+
+
+def is_empty_row(row):
+    # as pandas: no cell with a value, cells without text can have one
+    return all(cell.get(O_VALUE_TYPE) is None or cell_value(cell) == "" for cell in row)
+
+
+def row_values(row, wanted=None):
+    # wanted: column indexes to read (all when None), the others are not decoded
+    if wanted is None:
+        values = []
+        empty = 0
+        for _, repeat, cell in iter_cells(row):
+            value = cell_value(cell)
+            if value == "":
+                empty += repeat
+            else:
+                values.extend([""] * empty)
+                empty = 0
+                values.extend([value] * repeat)
+        return values
+    values = [""] * len(wanted)
+    for col, repeat, cell in iter_cells(row):
+        hits = [i for i, w in enumerate(wanted) if col <= w < col + repeat]
+        if hits:
+            value = cell_value(cell)
+            for i in hits:
+                values[i] = value
+    return values
+
+
+def iter_raw_rows(path, sheet_name):
+    # yields (row element, repeat) for the rows of one sheet, the element is
+    # dropped from the tree as soon as the consumer is done with it
+    with zipfile.ZipFile(path) as z, z.open("content.xml") as f:
+        stack = []
+        in_sheet = False
+        found = False
+        for event, el in ET.iterparse(f, events=("start", "end")):
+            if event == "start":
+                stack.append(el)
+                if el.tag == T_TABLE:
+                    in_sheet = el.get(T_NAME) == sheet_name
+                    found = found or in_sheet
+                continue
+            stack.pop()
+            if el.tag == T_ROW:
+                if in_sheet:
+                    yield el, int(el.get(T_ROWS_REPEATED, 1))
+                stack[-1].remove(el)
+            elif el.tag == T_TABLE:
+                if in_sheet:
+                    return
+                stack[-1].remove(el)
+        if not found:
+            raise ValueError(f"Worksheet named '{sheet_name}' not found")
+
+
+def dedup_names(names):
+    # same as pandas: "COD", "COD" -> "COD", "COD.1"
+    names = list(names)
+    counts = {}
+    for i, col in enumerate(names):
+        cur_count = counts.get(col, 0)
+        while cur_count > 0:
+            counts[col] = cur_count + 1
+            col = f"{col}.{cur_count}"
+            cur_count = counts.get(col, 0)
+        names[i] = col
+        counts[col] = cur_count + 1
+    return names
+
+
+def column_indexes(header, rename_columns, columns):
+    # column name (after renaming) -> index in the sheet
+    names = dedup_names(
+        value if value != "" else f"Unnamed: {i}" for i, value in enumerate(header)
+    )
+    indexes = {}
+    for i, name in enumerate(names):
+        name = rename_columns.get(name, name)
+        if name in columns and name not in indexes:
+            indexes[name] = i
+    # unnamed columns past the end of the header row
+    for name, target in rename_columns.items():
+        if target in columns and target not in indexes and name.startswith("Unnamed: "):
+            i = int(name[len("Unnamed: "):])
+            if i >= len(header):
+                indexes[target] = i
+    for col in columns:
+        assert col in indexes, f"{col} not present in columns: {names}"
+    return indexes
+
+
+def iter_rows(path, sheet_name, skiprows, skipfooter, rename_columns, columns):
+    # yields the header (column names, in sheet order) and then one tuple per
+    # data row with only those columns, None for NA
+    raw_index = 0
+    empty_rows = 0
+    header = None
+    wanted = None
+    footer = deque()
+    for row, repeat in iter_raw_rows(path, sheet_name):
+        if is_empty_row(row):
+            # only kept if some non-empty row follows
+            empty_rows += repeat
+            continue
+        pending = [None] * empty_rows + [row] * repeat
+        empty_rows = 0
+        for el in pending:
+            index = raw_index
+            raw_index += 1
+            if index < skiprows:
+                continue
+            if header is None:
+                header = row_values(el) if el is not None else []
+                indexes = column_indexes(header, rename_columns, columns)
+                names = sorted(indexes, key=indexes.get)
+                wanted = [indexes[name] for name in names]
+                yield tuple(names)
+                continue
+            if el is None:
+                values = (None,) * len(wanted)
+            else:
+                values = tuple(
+                    None if v in NA_VALUES else v for v in row_values(el, wanted)
+                )
+            footer.append(values)
+            if len(footer) > skipfooter:
+                yield footer.popleft()
+    if header is None:
+        raise ValueError(f"no header row in sheet '{sheet_name}' of {path}")
+
+
+def read_ods(path, sheet_name, skiprows, skipfooter, rename_columns, columns):
+    rows = iter_rows(path, sheet_name, skiprows, skipfooter, rename_columns, columns)
+    names = next(rows)
+    return pd.DataFrame.from_records(list(rows), columns=names)
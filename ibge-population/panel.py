@@ -0,0 +1,176 @@
+import os
+import logging
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+from codes import CODE_DTYPE
+
+if TYPE_CHECKING:
+    from estimates import Estimate
+    from census import Census
+
+# The populations of every source in one code x column matrix, one column per
+# (source, date), the columns sorted by date then source:
+#   codes       int32[n]         sorted IBGE codes
+#   dates       datetime64[D][m] P585 date of each column (censuses are on July 1st)
+#   sources     int16[m]         source of each column, index in source_ids
+#   method      int8[m]          METHOD_* of each column
+#   source_ids  str[k]           source_id() of each source
+#   hashes      str[k]           input_hash() of each source when it was built
+#   population  int64[n, m]
+#   valid       bool[n, m]       whether the cell has a population
+# Saved as one .npy file per array, so that load() can memory-map them.
+# main.py emits the QS commands from it, and --delta compares each source
+# with the panel of that source kept by the previous run (delta.py).
+
+PANEL_DIR = "./data/panel"
+ARRAYS = ("codes", "dates", "sources", "method", "source_ids", "hashes", "population", "valid")
+
+METHOD_NONE = 0
+METHOD_ESTIMATE = 1
+METHOD_CENSUS = 2
+
+
+class Panel:
+    def __init__(self, codes, dates, sources, method, source_ids, hashes, population, valid):
+        self.codes = codes
+        self.dates = dates
+        self.sources = sources
+        self.method = method
+        self.source_ids = source_ids
+        self.hashes = hashes
+        self.population = population
+        self.valid = valid
+
+    @classmethod
+    def build(cls, estimates: list["Estimate"], censuses: list["Census"]):
+        sources = [*censuses, *estimates]
+        columns = []  # (date, source, codes, populations, method)
+        for k, census in enumerate(censuses):
+            long = census.populations_long()
+            for year, group in long.groupby("year", sort=False):
+                columns.append(
+                    (f"{year}-07-01", k, group["code"].to_numpy(), group["population"].to_numpy(), METHOD_CENSUS)
+                )
+        for k, estimate in enumerate(estimates, len(censuses)):
+            codes, populations = estimate.populations()
+            columns.append((estimate.date, k, codes, populations, METHOD_ESTIMATE))
+        columns.sort(key=lambda column: column[0])  # stable: censuses first on the same date
+
+        codes = np.unique(np.concatenate([np.empty(0, CODE_DTYPE), *(c for _, _, c, _, _ in columns)]))
+        population = np.zeros((len(codes), len(columns)), dtype=np.int64)
+        valid = np.zeros((len(codes), len(columns)), dtype=bool)
+        for j, (_, _, source_codes, pops, _) in enumerate(columns):
+            rows = np.searchsorted(codes, source_codes)
+            population[rows, j] = pops
+            valid[rows, j] = True
+        panel = cls(
+            codes.astype(CODE_DTYPE),
+            np.array([d for d, _, _, _, _ in columns], dtype="datetime64[D]"),
+            np.array([k for _, k, _, _, _ in columns], dtype=np.int16),
+            np.array([m for _, _, _, _, m in columns], dtype=np.int8),
+            np.array([s.source_id() for s in sources], dtype=str),
+            np.array([s.input_hash() for s in sources], dtype=str),
+            population,
+            valid,
+        )
+        conflicts = sum(panel.merged(date)[2] for date in np.unique(panel.dates))
+        if conflicts:
+            logging.warning(f"{conflicts} cells with different populations in different sources, the first one is used")
+        logging.info(f"panel of {len(codes)} municipalities x {len(columns)} columns from {len(sources)} sources")
+        return panel
+
+    def save(self, directory=PANEL_DIR):
+        os.makedirs(directory, exist_ok=True)
+        for name in ARRAYS:
+            path = os.path.join(directory, f"{name}.npy")
+            tmp = os.path.join(directory, f"{name}.tmp.npy")
+            np.save(tmp, getattr(self, name))
+            os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, directory=PANEL_DIR, mmap=True):
+        mode = "r" if mmap else None
+        return cls(*(np.load(os.path.join(directory, f"{name}.npy"), mmap_mode=mode) for name in ARRAYS))
+
+    @classmethod
+    def load_fresh(cls, sources, directory=PANEL_DIR):
+        # the saved panel if it was built from these sources with the same
+        # input hashes, None otherwise (also for panels of an older layout)
+        if not all(os.path.exists(os.path.join(directory, f"{name}.npy")) for name in ARRAYS):
+            return None
+        panel = cls.load(directory)
+        if panel.source_ids.tolist() != [s.source_id() for s in sources]:
+            return None
+        if panel.hashes.tolist() != [s.input_hash() for s in sources]:
+            return None
+        return panel
+
+    def source(self, source_id):
+        k = np.flatnonzero(self.source_ids == source_id)
+        if not len(k):
+            raise KeyError(source_id)
+        return k[0]
+
+    def source_columns(self, source_id):
+        # (date, codes, populations) of each column of one source, the codes
+        # and populations of the municipalities it has data for
+        k = self.source(source_id)
+        columns = []
+        for j in np.flatnonzero(self.sources == k):
+            mask = self.valid[:, j]
+            columns.append((str(self.dates[j]), self.codes[mask], self.population[mask, j]))
+        return columns
+
+    def select(self, source_id):
+        # the panel of one source alone
+        k = self.source(source_id)
+        cols = np.flatnonzero(self.sources == k)
+        rows = np.flatnonzero(self.valid[:, cols].any(axis=1))
+        return Panel(
+            self.codes[rows],
+            self.dates[cols],
+            np.zeros(len(cols), dtype=np.int16),
+            self.method[cols],
+            self.source_ids[k:k + 1],
+            self.hashes[k:k + 1],
+            self.population[np.ix_(rows, cols)],
+            self.valid[np.ix_(rows, cols)],
+        )
+
+    def merged(self, date):
+        # populations and validity of every municipality at date, the first
+        # column with a population winning, and how many cells conflicted
+        cols = np.flatnonzero(self.dates == np.datetime64(date, "D"))
+        if not len(cols):
+            raise KeyError(date)
+        population = np.array(self.population[:, cols[0]])
+        valid = np.array(self.valid[:, cols[0]])
+        conflicts = 0
+        for j in cols[1:]:
+            both = valid & self.valid[:, j]
+            conflicts += np.count_nonzero(both & (population != self.population[:, j]))
+            take = self.valid[:, j] & ~valid
+            population[take] = self.population[take, j]
+            valid |= take
+        return population, valid, conflicts
+
+    def row(self, code):
+        i = np.searchsorted(self.codes, int(code))
+        if i == len(self.codes) or self.codes[i] != int(code):
+            raise KeyError(code)
+        return i
+
+    def series(self, code):
+        # date -> (population, method) of one municipality
+        i = self.row(code)
+        series = {}
+        for j in np.flatnonzero(self.valid[i]):
+            series.setdefault(str(self.dates[j]), (int(self.population[i, j]), int(self.method[j])))
+        return series
+
+    def column(self, date):
+        # codes and populations of every municipality with data at date
+        population, valid, _ = self.merged(date)
+        return self.codes[valid], population[valid]
@@ -0,0 +1,145 @@
+import os
+import glob
+import gzip
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from commands import Command
+from manifest import Manifest
+from metrics import METRICS
+
+
+# QID a QuickStatements command is about: "+Q1|...", "-Q1|..." or
+# "REMOVE_QUAL|Q1|..."
+def command_qid(cmd):
+    return Command.parse(cmd).item
+
+
+# Splits a stream of commands grouped by item (as in result.qs and
+# fix_populations.qs) into shards of at most max_commands commands and/or
+# max_bytes bytes, without ever splitting the commands of one item: an item
+# bigger than the limits gets a shard of its own. Shards are written (and
+# compressed) by a thread pool while the next ones are filled, and listed with
+# their QID range in <directory>/manifest.json so they can be submitted and
+# tracked separately.
+class ShardWriter:
+    def __init__(self, directory, prefix, max_commands=None, max_bytes=None, compress=False, jobs=4):
+        self.directory = directory
+        self.prefix = prefix
+        self.max_commands = max_commands
+        self.max_bytes = max_bytes
+        self.compress = compress
+        self.jobs = jobs
+        self.index = 0
+        self.shard = []  # lines of the shard being filled
+        self.shard_bytes = 0
+        self.shard_items = 0
+        self.item = []  # lines of the item being read
+        self.item_bytes = 0
+        self.item_qid = None
+
+    @classmethod
+    def from_args(cls, args, prefix):
+        # None unless sharding was asked for with add_shard_arguments() options
+        if args.shard_commands is None and args.shard_bytes is None:
+            return None
+        return cls(
+            args.shard_dir or f"./{prefix}.shards",
+            prefix,
+            max_commands=args.shard_commands,
+            max_bytes=args.shard_bytes,
+            compress=args.shard_gzip,
+        )
+
+    def __enter__(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self.manifest = Manifest(self.directory)
+        # shards of a previous run would be mixed with the new ones
+        for path in glob.glob(os.path.join(self.directory, f"{self.prefix}-*.qs*")):
+            os.remove(path)
+            self.manifest.entries.pop(self.manifest.key(path), None)
+        self.executor = ThreadPoolExecutor(max_workers=self.jobs)
+        self.pending = deque()
+        return self
+
+    def add(self, cmd):
+        qid = command_qid(cmd)
+        if qid != self.item_qid:
+            self.end_item()
+            self.item_qid = qid
+        line = cmd + "\n"
+        self.item.append(line)
+        self.item_bytes += len(line.encode())
+
+    def end_item(self):
+        if not self.item:
+            return
+        if self.shard and self.full(len(self.shard) + len(self.item), self.shard_bytes + self.item_bytes):
+            self.end_shard()
+        self.shard += self.item
+        self.shard_bytes += self.item_bytes
+        self.shard_items += 1
+        self.item = []
+        self.item_bytes = 0
+
+    def full(self, commands, size):
+        if self.max_commands is not None and commands > self.max_commands:
+            return True
+        return self.max_bytes is not None and size > self.max_bytes
+
+    def end_shard(self):
+        if not self.shard:
+            return
+        self.index += 1
+        suffix = ".qs.gz" if self.compress else ".qs"
+        path = os.path.join(self.directory, f"{self.prefix}-{self.index:05d}{suffix}")
+        meta = {
+            "first_qid": command_qid(self.shard[0]),
+            "last_qid": command_qid(self.shard[-1]),
+            "commands": len(self.shard),
+            "items": self.shard_items,
+            "bytes": self.shard_bytes,  # uncompressed
+        }
+        self.pending.append((self.executor.submit(write_shard, path, self.shard, self.compress), meta))
+        # at most 2 shards per thread are waiting in memory
+        while len(self.pending) >= 2 * self.jobs or (self.pending and self.pending[0][0].done()):
+            self.record(self.pending.popleft())
+        self.shard = []
+        self.shard_bytes = 0
+        self.shard_items = 0
+
+    def record(self, pending):
+        future, meta = pending
+        self.manifest.record(future.result(), status="pending", **meta)
+        METRICS.count("shards")
+
+    def close(self):
+        self.end_item()
+        self.end_shard()
+        while self.pending:
+            self.record(self.pending.popleft())
+        self.executor.shutdown()
+        logging.info(f"{self.index} shards written to {self.directory}")
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.executor.shutdown(cancel_futures=True)
+
+
+def write_shard(path, lines, compress):
+    tmp = path + ".tmp"
+    opener = gzip.open if compress else open
+    with opener(tmp, "wt", encoding="utf-8", newline="") as f:
+        f.writelines(lines)
+    os.replace(tmp, path)
+    return path
+
+
+def add_shard_arguments(parser, prefix):
+    parser.add_argument("--shard-commands", type=int, default=None, help="also write the commands in shards of at most this many commands")
+    parser.add_argument("--shard-bytes", type=int, default=None, help="also write the commands in shards of at most this many bytes")
+    parser.add_argument("--shard-gzip", action="store_true", help="gzip the shards")
+    parser.add_argument("--shard-dir", default=None, help=f"where the shards go (default: ./{prefix}.shards)")
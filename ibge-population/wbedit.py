@@ -0,0 +1,436 @@
+import asyncio
+import copy
+import gzip
+import json
+import logging
+import os
+import re
+import time
+
+import aiohttp
+
+from arguments import API
+from arguments import DRY_RUN_PATH
+from arguments import MAXLAG
+from arguments import PASSWORD_ENV
+from commands import P_METHOD
+from commands import P_POINT_IN_TIME
+from commands import REMOVE
+from commands import REMOVE_QUAL
+from commands import REMOVE_REF
+from commands import Command
+from fix_populations import Journal
+from http_client import RETRY_STATUSES
+from http_client import HttpClient
+from http_client import TokenBucket
+from http_client import retry_after
+from metrics import METRICS
+
+# Submits QuickStatements commands (result.qs, fix_populations.qs or their
+# shards) straight to the Wikibase Action API, with one wbeditentity edit per
+# item carrying all of its statement changes, instead of one edit per command.
+
+CALENDAR = "http://www.wikidata.org/entity/Q1985727"
+P_RETRIEVED = "P813"
+DEFAULT_SUMMARY = "IBGE population data"
+# qualifiers an added statement must not disagree on to be merged into an
+# existing statement with the same amount
+MATCH_QUALIFIERS = (P_POINT_IN_TIME, P_METHOD)
+ITEM = re.compile(r"Q\d+$")
+
+
+def read_commands(paths):
+    # QID -> its Commands in file order, from .qs files or gzipped shards
+    commands = {}
+    for path in paths:
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rt") as f:
+            for line in f:
+                if line.strip():
+                    cmd = Command.parse(line)
+                    commands.setdefault(cmd.item, []).append(cmd)
+    return commands
+
+
+# Action API snak of a QuickStatements value: Q1, "text", +2010-07-01T00:00:00Z/9
+# or an amount
+def snak(pid, value):
+    if value.startswith('"'):
+        datavalue = {"type": "string", "value": value[1:-1]}
+    elif ITEM.match(value):
+        datavalue = {
+            "type": "wikibase-entityid",
+            "value": {"entity-type": "item", "numeric-id": int(value[1:]), "id": value},
+        }
+    elif "/" in value:
+        time_value, precision = value.rsplit("/", 1)
+        datavalue = {
+            "type": "time",
+            "value": {
+                "time": time_value,
+                "timezone": 0,
+                "before": 0,
+                "after": 0,
+                "precision": int(precision),
+                "calendarmodel": CALENDAR,
+            },
+        }
+    else:
+        amount = value if value[0] in "+-" else f"+{value}"
+        datavalue = {"type": "quantity", "value": {"amount": amount, "unit": "1"}}
+    return {"snaktype": "value", "property": pid, "datavalue": datavalue}
+
+
+def snak_key(snak):
+    # what makes two snaks the same value: times only as far as their precision
+    # goes (as in existing.time_key), amounts without their sign
+    if snak.get("snaktype") != "value":
+        return snak["property"], snak.get("snaktype")
+    datavalue = snak["datavalue"]
+    value = datavalue["value"]
+    if datavalue["type"] == "time":
+        digits = {9: 4, 10: 7}.get(value["precision"], 10)
+        return snak["property"], value["time"].lstrip("+")[:digits], value["precision"]
+    if datavalue["type"] == "wikibase-entityid":
+        return snak["property"], value["id"]
+    if datavalue["type"] == "quantity":
+        return snak["property"], value["amount"].lstrip("+"), value.get("unit")
+    return snak["property"], json.dumps(value, sort_keys=True)
+
+
+def reference_key(reference):
+    # references that only differ in their retrieved date are the same one
+    return sorted(
+        snak_key(s) for pid, snaks in reference["snaks"].items() if pid != P_RETRIEVED for s in snaks
+    )
+
+
+def claim_key(claim):
+    # a statement as far as an edit sets it, without its id
+    return (
+        snak_key(claim["mainsnak"]),
+        sorted(snak_key(q) for qualifiers in claim.get("qualifiers", {}).values() for q in qualifiers),
+        sorted(reference_key(r) for r in claim.get("references", [])),
+    )
+
+
+def saved(payload, entity):
+    # whether the entity already has the changes of a wbeditentity payload
+    claims = [c for statements in entity.get("claims", {}).values() for c in statements]
+    ids = {c.get("id") for c in claims}
+    keys = [claim_key(c) for c in claims]
+    return all(
+        c["id"] not in ids if "remove" in c else claim_key(c) in keys
+        for c in payload["claims"]
+    )
+
+
+# The statements of one item after its commands, applied as QuickStatements
+# does: "+Q|P|amount|..." adds the qualifiers and the reference that are not
+# there yet to the statement with that amount (or to a new one), unless that
+# statement has another P585 or P459 value: a population of the same amount in
+# another year is a statement of its own, not a second P585. "-Q|P|amount"
+# removes that statement, and REMOVE_QUAL / REMOVE_REF remove a qualifier / the
+# references having a snak from it. payload() is the wbeditentity data of the
+# statements that changed. When `resubmit`, the commands go on an item an edit
+# of them may have reached: a "-Q|P|amount" without statement is then done.
+class ItemEdit:
+    def __init__(self, qid, entity, resubmit=False):
+        self.qid = qid
+        self.resubmit = resubmit
+        self.original = {c.get("id"): c for claims in entity.get("claims", {}).values() for c in claims}
+        self.claims = copy.deepcopy(entity.get("claims", {}))
+        self.touched = []  # changed or new statements
+        self.removed = []  # ids of removed statements
+        self.requalified = []  # statements a REMOVE_QUAL took a P585 or P459 from
+        self.summary = None
+
+    def statement(self, pid, amount, cmd):
+        key = snak_key(snak(pid, amount))
+        for claim in self.claims.get(pid, []):
+            if snak_key(claim["mainsnak"]) == key:
+                return claim
+        raise ValueError(f"no {pid} statement with value {amount} for {cmd}")
+
+    def touch(self, claim):
+        if not any(claim is c for c in self.touched):
+            self.touched.append(claim)
+
+    def apply(self, cmd: Command):
+        if cmd.summary:
+            self.summary = cmd.summary
+        if cmd.action in (REMOVE_QUAL, REMOVE_REF):
+            claim = self.statement(cmd.property, cmd.value, cmd)
+            for pid, value in cmd.qualifiers:
+                self.remove_qualifier(claim, snak(pid, value))
+                if pid in MATCH_QUALIFIERS and not any(claim is c for c in self.requalified):
+                    self.requalified.append(claim)
+            for pid, value in cmd.references:
+                self.remove_reference(claim, snak("P" + pid[1:], value))
+            self.touch(claim)
+        elif cmd.action == REMOVE:
+            try:
+                claim = self.statement(cmd.property, cmd.value, cmd)
+            except ValueError:
+                if not self.resubmit:
+                    raise
+                return
+            self.claims[cmd.property].remove(claim)
+            if "id" in claim:
+                self.removed.append(claim["id"])
+        else:
+            self.add(cmd)
+
+    def matching(self, cmd: Command):
+        # the statement an add command goes to: same amount, and for each of
+        # MATCH_QUALIFIERS in the command the same value or none at all, or
+        # any after a REMOVE_QUAL of this edit (fix_rules re-qualifies in
+        # place); a statement that already has the values goes first
+        key = snak_key(snak(cmd.property, cmd.value))
+        wanted = {pid: snak_key(snak(pid, value)) for pid, value in cmd.qualifiers if pid in MATCH_QUALIFIERS}
+        unqualified = None
+        for claim in self.claims.get(cmd.property, []):
+            if snak_key(claim["mainsnak"]) != key:
+                continue
+            qualifiers = claim.get("qualifiers", {})
+            present = {pid: {snak_key(q) for q in qualifiers.get(pid, [])} for pid in wanted}
+            if all(value in present[pid] for pid, value in wanted.items()):
+                return claim
+            if unqualified is None and (
+                any(claim is c for c in self.requalified)
+                or all(value in present[pid] or not present[pid] for pid, value in wanted.items())
+            ):
+                unqualified = claim
+        return unqualified
+
+    def add(self, cmd: Command):
+        claim = self.matching(cmd)
+        if claim is None:
+            claim = {"type": "statement", "rank": "normal", "mainsnak": snak(cmd.property, cmd.value)}
+            self.claims.setdefault(cmd.property, []).append(claim)
+        for pid, value in cmd.qualifiers:
+            qualifier = snak(pid, value)
+            if all(snak_key(q) != snak_key(qualifier) for q in claim.get("qualifiers", {}).get(pid, [])):
+                claim.setdefault("qualifiers", {}).setdefault(pid, []).append(qualifier)
+                order = claim.setdefault("qualifiers-order", [])
+                if pid not in order:
+                    order.append(pid)
+        reference = {"snaks": {}, "snaks-order": []}
+        for pid, value in cmd.references:
+            pid = "P" + pid[1:]
+            reference["snaks"].setdefault(pid, []).append(snak(pid, value))
+            if pid not in reference["snaks-order"]:
+                reference["snaks-order"].append(pid)
+        references = claim.get("references", [])
+        if reference["snaks"] and all(reference_key(r) != reference_key(reference) for r in references):
+            claim["references"] = [*references, reference]
+        self.touch(claim)
+
+    def remove_qualifier(self, claim, qualifier):
+        prop = qualifier["property"]
+        kept = [q for q in claim.get("qualifiers", {}).get(prop, []) if snak_key(q) != snak_key(qualifier)]
+        if kept:
+            claim["qualifiers"][prop] = kept
+        else:
+            claim.get("qualifiers", {}).pop(prop, None)
+            if prop in claim.get("qualifiers-order", []):
+                claim["qualifiers-order"].remove(prop)
+
+    def remove_reference(self, claim, part):
+        key = snak_key(part)
+        claim["references"] = [
+            r for r in claim.get("references", [])
+            if all(snak_key(s) != key for s in r["snaks"].get(part["property"], []))
+        ]
+
+    def payload(self):
+        # touched statements that are still there and differ from the entity:
+        # adding what a statement already has is no edit
+        present = [c for claims in self.claims.values() for c in claims]
+        claims = [{"id": guid, "remove": ""} for guid in self.removed]
+        claims += [
+            c for c in self.touched
+            if any(c is p for p in present) and c != self.original.get(c.get("id"))
+        ]
+        return {"claims": claims}
+
+
+class ApiError(Exception):
+    def __init__(self, error):
+        super().__init__(f"{error.get('code')}: {error.get('info')}")
+        self.code = error.get("code")
+
+
+# Action API session: bot password login, maxlag on every request (waiting as
+# long as the API says when the servers lag behind), and at most `edit_rate`
+# wbeditentity edits per second on top of the request rate of the client.
+class WikibaseWriter:
+    MAXLAG_RETRIES = 50
+    RESUBMITS = 3  # edits lost to a timeout or a server error, see edit()
+    BATCH_SIZE = 50  # wbgetentities limit for non-bot users
+
+    def __init__(self, client: HttpClient, api=API, edit_rate=1.0, maxlag=MAXLAG, dry_run=False):
+        self.client = client
+        self.api = api
+        self.edits = TokenBucket(edit_rate, capacity=1)
+        self.maxlag = maxlag
+        self.dry_run = dry_run
+        self.csrf_token = None
+
+    async def call(self, method, params, retry=True):
+        # a maxlag error is always retried: the request was refused, not applied
+        params = {**params, "format": "json", "maxlag": self.maxlag}
+        kwargs = {"data": params} if method == "POST" else {"params": params}
+        for attempt in range(self.MAXLAG_RETRIES + 1):
+            async with self.client.request(method, self.api, retry=retry, **kwargs) as response:
+                response.raise_for_status()
+                data = await response.json(content_type=None)
+                delay = retry_after(response)
+            error = data.get("error")
+            if error is None:
+                return data
+            if error.get("code") != "maxlag" or attempt == self.MAXLAG_RETRIES:
+                raise ApiError(error)
+            METRICS.count("wbedit.maxlag")
+            delay = self.maxlag if delay is None else delay
+            logging.info(f"maxlag: {error.get('info')}, waiting {delay:.0f}s")
+            await asyncio.sleep(delay)
+
+    async def token(self, kind):
+        data = await self.call("GET", {"action": "query", "meta": "tokens", "type": kind})
+        return data["query"]["tokens"][f"{kind}token"]
+
+    async def login(self, username, password):
+        params = {
+            "action": "login",
+            "lgname": username,
+            "lgpassword": password,
+            "lgtoken": await self.token("login"),
+        }
+        data = await self.call("POST", params)
+        if data["login"]["result"] != "Success":
+            raise ApiError({"code": "login", "info": data["login"].get("reason", data["login"]["result"])})
+        self.csrf_token = await self.token("csrf")
+        logging.info(f"logged in as {username}")
+
+    async def entities(self, qids):
+        data = await self.call("GET", {"action": "wbgetentities", "ids": "|".join(qids), "props": "claims|info"})
+        return data["entities"]
+
+    async def edit(self, qid, commands, entity, conflicts=1, resubmits=RESUBMITS):
+        # returns the new revision id, or None when there was nothing to change
+        edit = ItemEdit(qid, entity, resubmit=resubmits < self.RESUBMITS)
+        for cmd in commands:
+            edit.apply(cmd)
+        payload = edit.payload()
+        if not payload["claims"]:
+            return None
+        params = {
+            "action": "wbeditentity",
+            "id": qid,
+            "data": json.dumps(payload),
+            "baserevid": entity["lastrevid"],
+            "summary": edit.summary or DEFAULT_SUMMARY,
+            "bot": 1,
+        }
+        if self.dry_run:
+            with open(DRY_RUN_PATH, "a") as f:
+                f.write(json.dumps(params) + "\n")
+            return entity["lastrevid"]
+        await self.edits.acquire()
+        start = time.perf_counter()
+        try:
+            data = await self.submit(params)
+        except ApiError as e:
+            if e.code == "editconflict" and conflicts > 0:
+                # edited since it was fetched: apply the commands again on top
+                METRICS.count("wbedit.conflicts")
+                fresh = (await self.entities([qid]))[qid]
+                return await self.edit(qid, commands, fresh, conflicts - 1, resubmits)
+            raise
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            status = e.status if isinstance(e, aiohttp.ClientResponseError) else None
+            if status not in (None, *RETRY_STATUSES) or resubmits == 0:
+                raise
+            # the edit may have been saved anyway: sending the same new claims
+            # again would duplicate them, and applying the commands again on
+            # the saved item would remove and re-add statements, so the item
+            # is fetched again and only edited if it does not have the changes
+            METRICS.count("wbedit.resubmits")
+            delay = self.client.delay(self.RESUBMITS - resubmits)
+            reason = f"HTTP {status}" if status else repr(e)
+            logging.warning(f"[{qid}] edit failed ({reason}), checking the item again in {delay:.1f}s")
+            await asyncio.sleep(delay)
+            fresh = (await self.entities([qid]))[qid]
+            if fresh["lastrevid"] != entity["lastrevid"] and saved(payload, fresh):
+                METRICS.count("wbedit.saved_after_error")
+                logging.info(f"[{qid}] the edit was saved, revision {fresh['lastrevid']}")
+                return fresh["lastrevid"]
+            return await self.edit(qid, commands, fresh, conflicts, resubmits - 1)
+        METRICS.observe("wbeditentity", time.perf_counter() - start)
+        METRICS.count("wbedit.edits")
+        return data["entity"]["lastrevid"]
+
+    async def submit(self, params):
+        # never retried by the client, see edit()
+        try:
+            return await self.call("POST", {**params, "token": self.csrf_token}, retry=False)
+        except ApiError as e:
+            if e.code != "badtoken":
+                raise
+        # the session expired
+        self.csrf_token = await self.token("csrf")
+        return await self.call("POST", {**params, "token": self.csrf_token}, retry=False)
+
+    async def write(self, commands, journal):
+        # items are fetched in batches, each batch edited concurrently
+        qids = [qid for qid in commands if qid not in journal.done]
+
+        async def write_item(qid, entity):
+            try:
+                if "missing" in entity:
+                    raise ValueError("missing entity")
+                revision = await self.edit(qid, commands[qid], entity)
+            except Exception as e:
+                logging.warning(f"[{qid}] {e!r}")
+                journal.record(qid, None, repr(e))
+                return
+            logging.debug(f"[{qid}] {len(commands[qid])} commands, revision {revision}")
+            journal.record(qid, [cmd.serialize() for cmd in commands[qid]], None)
+
+        for i in range(0, len(qids), self.BATCH_SIZE):
+            batch = qids[i : i + self.BATCH_SIZE]
+            try:
+                entities = await self.entities(batch)
+            except Exception as e:
+                logging.exception(f"fetching {batch[0]}..{batch[-1]} failed")
+                for qid in batch:
+                    journal.record(qid, None, repr(e))
+                continue
+            await asyncio.gather(*(write_item(qid, entities[qid]) for qid in batch))
+
+
+# also the options of `python main.py write`
+def run(args):
+    password = os.environ.get(PASSWORD_ENV)
+    if not args.dry_run and not (args.username and password):
+        raise SystemExit(f"--username and ${PASSWORD_ENV} are needed to edit (or use --dry-run)")
+    if args.dry_run and not args.resume and os.path.exists(DRY_RUN_PATH):
+        os.remove(DRY_RUN_PATH)
+
+    async def submit(commands, journal):
+        async with HttpClient(concurrency=args.concurrency, rate=args.rate) as client:
+            writer = WikibaseWriter(
+                client, args.api, edit_rate=args.edits_per_minute / 60, maxlag=args.maxlag, dry_run=args.dry_run
+            )
+            if not args.dry_run:
+                await writer.login(args.username, password)
+            await writer.write(commands, journal)
+
+    with METRICS.reporting(args):
+        commands = read_commands(args.files)
+        logging.info(f"{sum(map(len, commands.values()))} commands for {len(commands)} items")
+        prefix = "wbedit.dry-run" if args.dry_run else "wbedit"
+        journal = Journal(f"{prefix}.journal.jsonl", f"{prefix}.failures.jsonl", resume=args.resume, name="wbedit")
+        with journal, METRICS.timer("wbedit"):
+            asyncio.run(submit(commands, journal))
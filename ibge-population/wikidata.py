@@ -1,10 +1,22 @@
+import os
+import time
+import logging
+from array import array
 from datetime import date
+from typing import TYPE_CHECKING
 
-import requests
-import pandas as pd
+import numpy as np
 
-from estimates import Estimate
-from census import Census
+from codes import CODE_DTYPE
+from codes import format_qids
+from codes import parse_codes
+from http_client import fetch_lines
+from metrics import METRICS
+
+if TYPE_CHECKING:
+    from estimates import Estimate
+    from census import Census
+    from panel import Panel
 
 
 class IbgeCodeToQid:
@@ -15,27 +27,153 @@ class IbgeCodeToQid:
     }
     """
     HEADERS = {
-        "Accept": "application/json",
-        "User-Agent": "arcstur/wikidata-scripts (https://github.com/arcstur/wikidata-scripts)",
+        "Accept": "text/tab-separated-values",
     }
-
-    def __init__(self):
-        pass
-
-    def load(self):
+    CACHE_PATH = "./data/cache/ibge_code_to_qid.npz"
+    CACHE_TTL = 24 * 60 * 60  # seconds
+
+    _shared = None
+
+    def __init__(self, cache_path=CACHE_PATH, ttl=CACHE_TTL):
+        self.cache_path = cache_path
+        self.ttl = ttl
+
+    @classmethod
+    def shared(cls, refresh=False):
+        # one mapper per process, loaded on first use
+        if cls._shared is None:
+            mapper = cls()
+            mapper.load(refresh=refresh)
+            cls._shared = mapper
+        return cls._shared
+
+    def load(self, refresh=False):
+        if not refresh and self.cache_age() < self.ttl:
+            METRICS.count("sparql.cache_hits")
+            self.load_cache()
+            return
+        try:
+            self.query()
+        except Exception:
+            if not os.path.exists(self.cache_path):
+                raise
+            logging.exception(f"SPARQL query failed, using stale {self.cache_path}")
+            self.load_cache()
+            return
+        self.save_cache()
+
+    def query(self):
         params = {"query": self.QUERY}
-        response = requests.get(self.ENDPOINT, params=params, headers=self.HEADERS)
-        response.raise_for_status()
-        data = response.json()
-        mapping = {}
-        for row in data["results"]["bindings"]:
-            qid = row["item"]["value"].split("/")[-1]
-            code = row["code"]["value"]
-            mapping[code] = qid
-        self.mapping = mapping
+        mapping = TsvMapping()
+        with METRICS.timer("sparql"):
+            fetch_lines(self.ENDPOINT, mapping.add, params=params, headers=self.HEADERS)
+        if mapping.skipped:
+            logging.warning(f"skipped {mapping.skipped} non-numeric IBGE codes")
+        codes = np.frombuffer(mapping.codes, dtype=np.int64).astype(CODE_DTYPE)
+        qids = np.frombuffer(mapping.qids, dtype=np.int64)
+        # stable, so for repeated codes the last row still wins on lookup
+        order = np.argsort(codes, kind="stable")
+        self.codes = codes[order]
+        self.qids = qids[order]
+        self.fetched_at = time.time()
+        METRICS.count("sparql.rows", len(self.codes))
+        logging.info(f"loaded {len(self.codes)} IBGE codes from SPARQL")
+        duplicates = self.duplicates()
+        if duplicates:
+            METRICS.count("sparql.duplicate_codes", len(duplicates))
+            shown = ", ".join(f"{code}: {qids}" for code, qids in list(duplicates.items())[:20])
+            logging.warning(
+                f"{len(duplicates)} IBGE codes have several QIDs, the last one is used: {shown}"
+            )
+
+    def duplicates(self):
+        # code -> all its QIDs (as "Q.."), for the codes with more than one
+        conflict = (self.codes[1:] == self.codes[:-1]) & (self.qids[1:] != self.qids[:-1])
+        duplicates = {}
+        for code in np.unique(self.codes[1:][conflict]):
+            qids = self.qids[self.codes == code]
+            duplicates[int(code)] = [f"Q{qid}" for qid in dict.fromkeys(qids.tolist())]
+        return duplicates
+
+    def cache_age(self):
+        if not os.path.exists(self.cache_path):
+            return float("inf")
+        return time.time() - os.path.getmtime(self.cache_path)
+
+    def load_cache(self):
+        with np.load(self.cache_path) as data:
+            self.codes = data["codes"]
+            self.qids = data["qids"]
+            self.fetched_at = float(data["fetched_at"])
+        logging.info(f"loaded {len(self.codes)} IBGE codes from {self.cache_path}")
+
+    def save_cache(self):
+        os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+        tmp = self.cache_path + ".tmp.npz"
+        np.savez(tmp, codes=self.codes, qids=self.qids, fetched_at=self.fetched_at)
+        os.replace(tmp, self.cache_path)
 
     def qid(self, code):
-        return self.mapping[str(code)]
+        try:
+            key = int(code)
+        except ValueError:
+            raise KeyError(code)
+        i = np.searchsorted(self.codes, key, side="right") - 1
+        if i < 0 or self.codes[i] != key:
+            raise KeyError(code)
+        return f"Q{self.qids[i]}"
+
+    def unique(self):
+        # sorted unique codes and their QID, repeated codes resolved like qid() does
+        last = np.append(self.codes[1:] != self.codes[:-1], True)
+        return self.codes[last], self.qids[last]
+
+    def join(self, df):
+        # adds a "qid" column to df (which has an int32 "code" column), looked
+        # up with one searchsorted over the sorted codes; all codes without a
+        # QID are reported at once
+        codes = parse_codes(df["code"])
+        keys, qids = self.unique()
+        i = np.minimum(np.searchsorted(keys, codes), max(len(keys) - 1, 0))
+        found = keys[i] == codes if len(keys) else np.zeros(len(codes), dtype=bool)
+        if not found.all():
+            unmatched = sorted(set(codes[~found].tolist()))
+            raise KeyError(f"no QID for {len(unmatched)} IBGE codes: {unmatched}")
+        return df.assign(code=codes, qid=qids[i]).reset_index(drop=True)
+
+    def all_qids(self):
+        return format_qids(np.unique(self.qids)).tolist()
+
+
+# (code, QID) pairs of a SPARQL ?item ?code result in TSV, added line by line
+# to int arrays without decoding the lines
+class TsvMapping:
+    HEADER = b"?item\t?code"
+    ITEM_PREFIX = b"<http://www.wikidata.org/entity/Q"
+
+    def __init__(self):
+        self.codes = array("q")
+        self.qids = array("q")
+        self.skipped = 0
+        self.started = False
+
+    def add(self, line):
+        line = line.rstrip(b"\r\n")
+        if not self.started:
+            if line != self.HEADER:
+                raise ValueError(f"not a SPARQL TSV result of ?item ?code: {line[:200]!r}")
+            self.started = True
+            return
+        if not line:
+            return
+        item, _, code = line.partition(b"\t")
+        code = code[1:-1]  # "1100015"
+        if not item.startswith(self.ITEM_PREFIX) or not code.isdigit():
+            self.skipped += 1
+            return
+        self.codes.append(int(code))
+        # <http://www.wikidata.org/entity/Q123> -> 123
+        self.qids.append(int(item[len(self.ITEM_PREFIX):-1]))
 
 
 P_POPULATION = "P1082"
@@ -45,64 +183,71 @@ S_REF_URL = "S854"
 S_RETRIEVED = "S813"
 
 
+def qs_commands(df, method, url, retrieved):
+    # df: one row per statement with qid, population and time (P585 value)
+    return (
+        "+Q"
+        + df["qid"].astype(str)
+        + f"|{P_POPULATION}|"
+        + df["population"].astype(str)
+        + f"|{P_POINT_IN_TIME}|"
+        + df["time"]
+        + f"|{P_METHOD}|{method}|{S_REF_URL}|"
+        + f'"{url}"|{S_RETRIEVED}|{retrieved}'
+    )
+
+
+def source_frame(panel: "Panel", source_id):
+    # one row per code, date and population of one source of the panel
+    import pandas as pd  # only the emitters need it, not the P1585 mapping users
+
+    columns = panel.source_columns(source_id)
+    return pd.DataFrame({
+        "code": np.concatenate([np.empty(0, CODE_DTYPE), *(codes for _, codes, _ in columns)]),
+        "date": np.repeat(np.array([d for d, _, _ in columns], dtype=str), [len(c) for _, c, _ in columns]),
+        "population": np.concatenate([np.empty(0, np.int64), *(pops for _, _, pops in columns)]),
+    })
+
+
+def sorted_commands(df):
+    # (sort key, command) pairs of a to_qs_frame() frame ordered by QID and
+    # year, the key is computed once per command
+    keys = "+Q" + df["qid"].astype(str) + df["time"].str[:5]
+    order = keys.sort_values(kind="stable").index
+    return zip(keys[order].tolist(), df["command"][order].tolist())
+
+
 class EstimateToQs:
     Q_ESTIMATION = "Q791801"
 
-    def __init__(self):
-        self.mapper = IbgeCodeToQid()
-        self.mapper.load()
+    def __init__(self, mapper=None):
+        self.mapper = mapper or IbgeCodeToQid.shared()
 
-    def to_qs_list(self, estimate: Estimate):
+    def to_qs_frame(self, estimate: "Estimate", panel: "Panel"):
         retrieved = f"+{date.today().isoformat()}T00:00:00Z/11"
-        qs_list = []
-        for code, population in estimate.populations().items():
-            qid = self.mapper.qid(code)
-            statement = [f"+{qid}", P_POPULATION, str(population)]
-            qualifiers = [
-                P_POINT_IN_TIME,
-                f"+{estimate.date}T00:00:00Z/11",
-                P_METHOD,
-                self.Q_ESTIMATION,
-            ]
-            reference = [
-                S_REF_URL,
-                f'"{estimate.url}"',
-                S_RETRIEVED,
-                retrieved,
-            ]
-            qs = "|".join(statement + qualifiers + reference)
-            qs_list.append(qs)
-        return qs_list
+        df = self.mapper.join(source_frame(panel, estimate.source_id()))
+        df["time"] = f"+{estimate.date}T00:00:00Z/11"
+        df["method"] = self.Q_ESTIMATION
+        df["command"] = qs_commands(df, self.Q_ESTIMATION, estimate.url, retrieved)
+        return df
+
+    def to_qs_list(self, estimate: "Estimate", panel: "Panel"):
+        return self.to_qs_frame(estimate, panel)["command"].tolist()
 
 
 class CensusToQs:
     Q_CENSUS = "Q39825"
 
-    def __init__(self):
-        self.mapper = IbgeCodeToQid()
-        self.mapper.load()
+    def __init__(self, mapper=None):
+        self.mapper = mapper or IbgeCodeToQid.shared()
 
-    def to_qs_list(self, census: Census):
+    def to_qs_frame(self, census: "Census", panel: "Panel"):
         retrieved = f"+{date.today().isoformat()}T00:00:00Z/11"
-        qs_list = []
-        for code, populations_per_year in census.populations_per_year().items():
-            qid = self.mapper.qid(code)
-            for year, population in populations_per_year.items():
-                if pd.isna(population) or not population:
-                    continue
-                statement = [f"+{qid}", P_POPULATION, str(population)]
-                qualifiers = [
-                    P_POINT_IN_TIME,
-                    f"+{year}-07-01T00:00:00Z/9",  # year precision
-                    P_METHOD,
-                    self.Q_CENSUS,
-                ]
-                reference = [
-                    S_REF_URL,
-                    f'"{census.url}"',
-                    S_RETRIEVED,
-                    retrieved,
-                ]
-                qs = "|".join(statement + qualifiers + reference)
-                qs_list.append(qs)
-        return qs_list
+        df = self.mapper.join(source_frame(panel, census.source_id()))
+        df["time"] = "+" + df["date"] + "T00:00:00Z/9"  # year precision
+        df["method"] = self.Q_CENSUS
+        df["command"] = qs_commands(df, self.Q_CENSUS, census.url, retrieved)
+        return df
+
+    def to_qs_list(self, census: "Census", panel: "Panel"):
+        return self.to_qs_frame(census, panel)["command"].tolist()